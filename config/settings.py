@@ -9,6 +9,17 @@ load_dotenv()
 class Settings:
     # Telegram
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+    # Пул соединений для исходящих запросов бота и отдельный пул для getUpdates
+    TELEGRAM_POOL_LIMIT = int(os.getenv("TELEGRAM_POOL_LIMIT", "64"))
+    TELEGRAM_POLLING_POOL_LIMIT = int(os.getenv("TELEGRAM_POLLING_POOL_LIMIT", "4"))
+    # Таймаут запроса к API, включая ожидание свободного соединения в пуле
+    TELEGRAM_POOL_TIMEOUT = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "60"))
+    # Webhook: если WEBHOOK_URL не задан, бот работает через long-polling
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
     
     # Yandex
     YANDEX_SPEECHKIT_API_KEY = os.getenv("YANDEX_SPEECHKIT_API_KEY")
@@ -2,6 +2,7 @@
 # Описание: Pipeline для обработки текста (Фаза 1)
 
 import asyncio
+import inspect
 from typing import Dict, Any, Optional
 import logging
 from datetime import datetime
@@ -205,9 +206,11 @@ class TextPipeline:
             raise
     
     async def _notify(self, callbacks: Optional[Dict[str, Any]], event: str, message: str):
-        """Отправляет уведомление через коллбек"""
+        """Отправляет уведомление через коллбек (синхронный или асинхронный)"""
         if callbacks and event in callbacks:
             try:
-                await callbacks[event](message)
+                result = callbacks[event](message)
+                if inspect.isawaitable(result):
+                    await result
             except Exception as e:
                 logger.error(f"Ошибка в коллбеке {event}: {e}")
\ No newline at end of file
@@ -2,14 +2,41 @@
 # Обработка текста через два диалога Claude для создания качественных рассказов
 
 import anthropic
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable
 import asyncio
 import logging
 import json
+import string
 from datetime import datetime
+from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
+_formatter = string.Formatter()
+
+@lru_cache(maxsize=128)
+def compile_prompt_template(template: str) -> Callable[..., str]:
+    """
+    Разбирает шаблон промпта один раз и возвращает функцию подстановки.
+    
+    Поведение совпадает с str.format для именованных полей, но шаблон
+    не парсится заново при каждом вызове. Код из шаблона не исполняется,
+    поэтому пользовательские промпты безопасны.
+    """
+    parsed = tuple(_formatter.parse(template))
+    
+    def render(**values) -> str:
+        parts = []
+        for literal, field_name, format_spec, conversion in parsed:
+            parts.append(literal)
+            if field_name is not None:
+                value, _ = _formatter.get_field(field_name, (), values)
+                value = _formatter.convert_field(value, conversion)
+                parts.append(_formatter.format_field(value, format_spec))
+        return "".join(parts)
+    
+    return render
+
 class DualClaudeProcessor:
     """
     Процессор использующий два диалога Claude:
@@ -64,7 +91,7 @@ class DualClaudeProcessor:
         """Первый Claude: создает детальный план рассказа"""
         
         # Подставляем переменные в шаблон
-        prompt = prompt_template.format(
+        prompt = compile_prompt_template(prompt_template)(
             text=transcription,
             target_words=self.target_words
         )
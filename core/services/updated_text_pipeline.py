@@ -2,6 +2,7 @@
 # Обновленный pipeline с двойной обработкой Claude
 
 import asyncio
+import inspect
 from typing import Dict, Any, Optional
 import logging
 from datetime import datetime
@@ -236,9 +237,11 @@ class UpdatedTextPipeline:
             raise
     
     async def _notify(self, callbacks: Optional[Dict[str, Any]], event: str, message: str):
-        """Отправляет уведомление через коллбек"""
+        """Отправляет уведомление через коллбек (синхронный или асинхронный)"""
         if callbacks and event in callbacks:
             try:
-                await callbacks[event](message)
+                result = callbacks[event](message)
+                if inspect.isawaitable(result):
+                    await result
             except Exception as e:
                 logger.error(f"Ошибка в коллбеке {event}: {e}")
\ No newline at end of file
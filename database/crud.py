@@ -1,11 +1,25 @@
 # database/crud.py
+import logging
+import threading
+from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from database.models import ProjectV2, PlanV2, ProcessingSettings
+import orjson
+from database.models import ProjectV2, PlanV2, ProcessingSettings, ProcessingLog
 from config.settings import settings
 
-engine = create_engine(settings.DATABASE_URL)
+logger = logging.getLogger(__name__)
+
+def _json_dumps(value) -> str:
+    return orjson.dumps(value).decode()
+
+# JSON-колонки (text_steps, speech_chunks и т.д.) сериализуются через orjson
+engine = create_engine(
+    settings.DATABASE_URL,
+    json_serializer=_json_dumps,
+    json_deserializer=orjson.loads
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db():
@@ -24,6 +38,15 @@ def create_project(data: dict):
     db.close()
     return project
 
+def bulk_create_projects(rows: list):
+    """Вставляет пачку проектов одним коммитом"""
+    db = SessionLocal()
+    try:
+        db.bulk_insert_mappings(ProjectV2, rows)
+        db.commit()
+    finally:
+        db.close()
+
 def get_project(project_id: str):
     db = SessionLocal()
     project = db.query(ProjectV2).filter(ProjectV2.id == project_id).first()
@@ -54,9 +77,102 @@ def update_project(project_id: str, data: dict):
     db.commit()
     db.close()
 
+class ProjectWriter:
+    """
+    Копит изменения одного проекта (последнее значение поля побеждает) и
+    пишет их одним UPDATE: через delay секунд после первого patch или при flush()
+    """
+    
+    def __init__(self, project_id: str, delay: float = 5.0):
+        self.project_id = project_id
+        self.delay = delay
+        self.pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+    
+    def patch(self, data: dict):
+        with self._lock:
+            self.pending.update(data)
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+    
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            data, self.pending = self.pending, {}
+        
+        if not data:
+            return
+        
+        try:
+            update_project(self.project_id, data)
+        except Exception:
+            # Не теряем изменения: следующий patch или flush запишет их снова,
+            # а исключение не подменяет собой retry или ошибку задачи
+            logger.exception(f"Ошибка записи проекта {self.project_id}")
+            with self._lock:
+                self.pending = {**data, **self.pending}
+
+class LogBuffer:
+    """
+    Копит записи processing_logs и пишет их пачкой в одной транзакции:
+    каждые flush_interval секунд или как только набралось max_entries записей
+    """
+    
+    def __init__(self, flush_interval: float = 0.5, max_entries: int = 256):
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.entries = []
+        self._lock = threading.Lock()
+        self._timer = None
+    
+    def push(self, project_id: str, level: str, step: str, message: str):
+        with self._lock:
+            self.entries.append({
+                "project_id": project_id,
+                "timestamp": datetime.utcnow(),
+                "level": level,
+                "step": step,
+                "message": message
+            })
+            full = len(self.entries) >= self.max_entries
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        
+        if full:
+            self.flush()
+    
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            entries, self.entries = self.entries, []
+        
+        if not entries:
+            return
+        
+        db = SessionLocal()
+        try:
+            db.bulk_insert_mappings(ProcessingLog, entries)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Ошибка записи логов обработки ({len(entries)} шт.): {e}")
+        finally:
+            db.close()
+
+log_buffer = LogBuffer()
+
 def add_log(project_id: str, level: str, step: str, message: str):
-    # Простая заглушка для логов
-    print(f"[{level}] {project_id} - {step}: {message}")
+    """Добавляет запись в processing_logs (пишется пачкой через log_buffer)"""
+    log_buffer.push(project_id, level, step, message)
 
 def create_plan(plan_data: dict):
     db = SessionLocal()
@@ -5,6 +5,7 @@ from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float,
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
+from functools import cached_property
 
 Base = declarative_base()
 
@@ -32,6 +33,28 @@ class PlanV2(Base):
     
     # Связи
     projects = relationship("ProjectV2", back_populates="plan")
+    
+    @cached_property
+    def steps_by_type(self):
+        """Шаги фазы 1 по типу; строится один раз на загруженный объект"""
+        return {step["type"]: step for step in self.text_steps or []}
+    
+    @cached_property
+    def _plan_dict(self):
+        return {
+            "name": self.name,
+            "description": self.description,
+            "text_steps": self.text_steps,
+            "video_steps": self.video_steps,
+            "default_prompt": self.default_prompt,
+            "default_voice": self.default_voice,
+            "modules_enabled": self.modules_enabled,
+            "metadata": {}
+        }
+    
+    def to_dict(self):
+        """План в виде словаря для pipeline; собирается один раз на загруженный объект"""
+        return self._plan_dict
 
 class ProcessingSettings(Base):
     __tablename__ = "processing_settings_v2"
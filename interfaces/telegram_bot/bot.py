@@ -3,23 +3,33 @@
 
 import asyncio
 import logging
-import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from datetime import datetime
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.filters import Command, StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-import uuid
+from ulid import ULID
+from redis.asyncio import Redis
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from config.settings import settings
+from interfaces.telegram_bot.throttling import ThrottledBot
+from interfaces.telegram_bot.validators import is_youtube_url
+from interfaces.telegram_bot.runner import poll_updates, run_webhook
 from database.crud import (
     create_project, get_plans, get_default_settings, 
-    get_project, create_plan, get_plan
+    get_project, create_plan, get_plan, bulk_create_projects, update_project
 )
 
 logging.basicConfig(level=logging.INFO)
@@ -30,8 +40,31 @@ if not settings.TELEGRAM_TOKEN:
     logger.error("TELEGRAM_TOKEN не установлен!")
     raise ValueError("Необходимо установить TELEGRAM_TOKEN в .env файле")
 
-bot = Bot(token=settings.TELEGRAM_TOKEN)
-dp = Dispatcher()
+def _create_session(limit: int) -> AiohttpSession:
+    """Сессия с постоянным пулом соединений к api.telegram.org"""
+    # keep-alive избавляет от повторных TLS-рукопожатий
+    session = AiohttpSession(timeout=settings.TELEGRAM_POOL_TIMEOUT)
+    # В aiogram 3.3 параметры пула задаются только через настройки коннектора
+    session._connector_init.update(
+        limit=limit, limit_per_host=limit, ttl_dns_cache=300, keepalive_timeout=75
+    )
+    return session
+
+# Исходящие запросы проходят через лимитер, чтобы не получать 429 от Telegram
+session = _create_session(settings.TELEGRAM_POOL_LIMIT)
+bot = ThrottledBot(token=settings.TELEGRAM_TOKEN, session=session)
+
+# Long-polling держит соединение открытым: отдельный маленький пул,
+# чтобы getUpdates не занимал соединения исходящих сообщений
+polling_bot = Bot(
+    token=settings.TELEGRAM_TOKEN,
+    session=_create_session(settings.TELEGRAM_POLLING_POOL_LIMIT)
+)
+# Состояние пользователей хранится в Redis: переживает рестарт
+# и доступно нескольким процессам бота
+FSM_TTL = 30 * 60  # 30 минут на создание плана или выбор видео
+redis_client = Redis.from_url(settings.REDIS_URL, decode_responses=True)
+dp = Dispatcher(storage=RedisStorage(redis=redis_client, state_ttl=FSM_TTL, data_ttl=FSM_TTL))
 
 # ===== СОСТОЯНИЯ =====
 class VideoStates(StatesGroup):
@@ -39,12 +72,28 @@ class VideoStates(StatesGroup):
     selecting_plan = State()
 
 class PlanCreationStates(StatesGroup):
-    entering_name = State()
-    entering_description = State()
-    selecting_type = State()
-    entering_custom_prompt = State()
-    entering_voice_settings = State()
-    reviewing_plan = State()
+    # Текущий шаг создания плана хранится в данных FSM под ключом "step"
+    entering = State()
+
+# Шаги создания плана
+(
+    STEP_NAME,
+    STEP_DESCRIPTION,
+    STEP_TYPE,
+    STEP_CUSTOM_PROMPT,
+    STEP_VOICE,
+    STEP_REVIEW
+) = range(6)
+
+# ===== CALLBACK DATA =====
+class TplCB(CallbackData, prefix="tpl"):
+    id: str
+
+class VoiceCB(CallbackData, prefix="voice"):
+    id: str
+
+class PlanCB(CallbackData, prefix="plan"):
+    id: int
 
 # ===== КОНСТАНТЫ =====
 # Целевое количество слов для 80-100 минут видео
@@ -131,57 +180,294 @@ PLAN_TEMPLATES = {
     }
 }
 
-# Хранилище активных проектов
-user_projects = {}
-plan_creation_data = {}
+# Ключи шаблонов и упакованные callback_data интернируем: при сравнении
+# в фильтрах совпадение определяется уже по идентичности строк
+PLAN_TEMPLATES = {sys.intern(k): v for k, v in PLAN_TEMPLATES.items()}
+TEMPLATE_IDS = {k: sys.intern(TplCB(id=k).pack()) for k in PLAN_TEMPLATES}
+
+# Тексты и клавиатуры, которые не зависят от пользователя, собираем один раз
+_START_TEXT = (
+    "👋 Привет! Я помогу превратить YouTube видео в увлекательные рассказы.\n\n"
+    "🎯 Что я умею:\n"
+    "• Скачиваю видео и извлекаю текст\n"
+    "• Создаю из него захватывающий рассказ (80-100 минут)\n"
+    "• Озвучиваю через Yandex SpeechKit\n"
+    "• Сохраняю на Яндекс.Диск\n\n"
+    "🎨 Использую двойную обработку Claude AI для максимального качества\n\n"
+    "Выберите действие:"
+)
+
+START_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📹 Новое видео", callback_data="new_video")],
+    [InlineKeyboardButton(text="📋 Управление планами", callback_data="manage_plans")],
+    [InlineKeyboardButton(text="📊 Мои проекты", callback_data="my_projects")],
+    [InlineKeyboardButton(text="❓ Помощь", callback_data="help")]
+])
+
+MANAGE_PLANS_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="➕ Создать новый план", callback_data="create_plan")],
+    [InlineKeyboardButton(text="📋 Список планов", callback_data="list_plans")],
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+])
+
+LIST_PLANS_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="➕ Создать новый", callback_data="create_plan")],
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+])
+
+TEMPLATES_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    *[
+        [InlineKeyboardButton(text=template_info["name"], callback_data=TEMPLATE_IDS[template_id])]
+        for template_id, template_info in PLAN_TEMPLATES.items()
+    ],
+    [InlineKeyboardButton(text="✏️ Свой промпт", callback_data="custom_prompt")]
+])
+
+# Голоса озвучки: полное название для шаблонов, короткое для своего промпта
+VOICES = {
+    "alena": ("👩 Алёна", "нейтральный"),
+    "jane": ("👩 Джейн", "эмоциональный"),
+    "omazh": ("👨 Омаж", "мужской")
+}
+VOICE_IDS = {k: sys.intern(VoiceCB(id=k).pack()) for k in VOICES}
+
+VOICE_KEYBOARD_FULL = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=f"{name} ({hint})", callback_data=VOICE_IDS[voice_id])]
+    for voice_id, (name, hint) in VOICES.items()
+])
+
+VOICE_KEYBOARD_SHORT = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=name, callback_data=VOICE_IDS[voice_id])]
+    for voice_id, (name, _) in VOICES.items()
+])
+
+REVIEW_PLAN_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="✅ Сохранить", callback_data="save_plan"),
+    InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_plan")
+]])
+
+_MANAGE_PLANS_TEXT = (
+    "📋 *Управление планами обработки*\n\n"
+    "Активных планов: {count}\n\n"
+    "Планы определяют, как видео превращается в рассказ"
+)
+
+_CUSTOM_PROMPT_TEXT = (
+    "✏️ *Свой промпт для первого Claude*\n\n"
+    "Введите промпт, который будет использоваться для создания плана рассказа.\n\n"
+    "Используйте переменные:\n"
+    "• `{text}` - транскрипция видео\n"
+    "• `{target_words}` - целевое количество слов\n\n"
+    "Отправьте промпт следующим сообщением:"
+)
+
+_NEW_VIDEO_TEXT = (
+    "📹 Отправьте ссылку на YouTube видео:\n\n"
+    "Поддерживаются форматы:\n"
+    "• https://youtube.com/watch?v=...\n"
+    "• https://youtu.be/...\n"
+    "• https://m.youtube.com/watch?v=..."
+)
+
+# ===== ХРАНИЛИЩЕ В REDIS =====
+USER_PROJECTS_TTL = 30 * 24 * 60 * 60  # 30 дней
+
+@dataclass(slots=True)
+class PlanDraft:
+    """Черновик создаваемого плана"""
+    name: str = ""
+    description: str = ""
+    template: str = "custom"
+    prompt_template: str = ""
+    voice: str = ""
+
+_PLAN_DRAFT_FIELDS = tuple(f.name for f in fields(PlanDraft))
+
+def _plan_draft_from_data(data: dict) -> PlanDraft:
+    return PlanDraft(**{k: v for k, v in data.items() if k in _PLAN_DRAFT_FIELDS})
+
+async def get_plan_draft(state: FSMContext) -> PlanDraft:
+    """Черновик плана хранится в данных FSM рядом с номером шага"""
+    return _plan_draft_from_data(await state.get_data())
+
+async def add_user_project(user_id: int, project_id: str):
+    """Запоминает проект пользователя"""
+    key = f"user_projects:{user_id}"
+    async with redis_client.pipeline(transaction=False) as pipe:
+        await pipe.rpush(key, project_id).expire(key, USER_PROJECTS_TTL).execute()
+
+# ===== АСИНХРОННЫЕ ОБЁРТКИ CRUD =====
+# CRUD синхронный: выполняем его в пуле потоков, чтобы не блокировать event loop
+async def aget_plans(**kwargs):
+    return await asyncio.to_thread(get_plans, **kwargs)
+
+async def aget_plan(plan_id: int):
+    return await asyncio.to_thread(get_plan, plan_id)
+
+async def acreate_plan(plan_data: dict):
+    return await asyncio.to_thread(create_plan, plan_data)
+
+async def acreate_project(data: dict):
+    return await asyncio.to_thread(create_project, data)
+
+async def aget_default_settings():
+    return await asyncio.to_thread(get_default_settings)
+
+# ===== ОТЛОЖЕННАЯ ЗАПИСЬ ПРОЕКТОВ =====
+# ID проекта генерируется на клиенте, поэтому проекты копятся в буфере
+# и пишутся в БД пачкой, одним коммитом. Буфер живет только в памяти:
+# пользователь получает подтверждение лишь после записи пачки.
+# Задачи Celery публикуются только после вставки, иначе воркер не найдет проект
+PROJECT_FLUSH_INTERVAL = 0.2
+PROJECT_FLUSH_SIZE = 32
+
+_pending_projects = []  # (row, future с результатом записи)
+_projects_full = asyncio.Event()
+_flush_lock = asyncio.Lock()
+_flusher_task = None
+
+def queue_project(row: dict) -> asyncio.Future:
+    """Ставит проект в очередь на запись и запуск обработки; future получит True, если проект записан"""
+    global _flusher_task
+    
+    saved = asyncio.get_running_loop().create_future()
+    _pending_projects.append((row, saved))
+    if len(_pending_projects) >= PROJECT_FLUSH_SIZE:
+        _projects_full.set()
+    
+    if _flusher_task is None or _flusher_task.done():
+        _flusher_task = asyncio.create_task(_projects_flusher())
+    return saved
+
+async def _projects_flusher():
+    # Работает, пока есть что записывать; новый запустится при следующем проекте
+    while _pending_projects:
+        try:
+            await asyncio.wait_for(_projects_full.wait(), PROJECT_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        await flush_projects()
+
+async def _notify_chat(chat_id: int, text: str):
+    try:
+        await bot.send_message(chat_id, text)
+    except Exception as e:
+        logger.error("Ошибка отправки сообщения в чат %s: %s", chat_id, e)
+
+async def _fail_unstarted_project(row: dict):
+    """Проект записан, но задача не отправлена: помечаем его failed, чтобы он не висел в created"""
+    try:
+        await asyncio.to_thread(update_project, row["id"], {
+            "status": "failed",
+            "error_message": "Не удалось отправить задачу обработки",
+            "completed_at": datetime.now()
+        })
+    except Exception as e:
+        logger.error("Ошибка обновления статуса проекта %s: %s", row["id"], e)
+    await _notify_chat(row["telegram_chat_id"], "❌ Произошла ошибка при запуске обработки.")
+
+async def flush_projects():
+    """Записывает накопленные проекты и запускает их обработку"""
+    async with _flush_lock:
+        _projects_full.clear()
+        entries = _pending_projects[:]
+        _pending_projects.clear()
+        if not entries:
+            return
+        
+        rows = [row for row, _ in entries]
+        try:
+            await asyncio.to_thread(bulk_create_projects, rows)
+            results = [True] * len(rows)
+        except Exception as e:
+            # Пачка не записалась — пишем по одному, чтобы не терять остальные
+            logger.error("Ошибка пакетной записи проектов: %s", e)
+            results = []
+            for row in rows:
+                try:
+                    await acreate_project(row)
+                    results.append(True)
+                except Exception as e:
+                    logger.error("Ошибка записи проекта %s: %s", row["id"], e)
+                    results.append(False)
+        
+        # Ответ пользователю отправляет обработчик, дождавшийся своей future
+        for (_, saved), ok in zip(entries, results):
+            if not saved.done():
+                saved.set_result(ok)
+        
+        saved_rows = [row for row, ok in zip(rows, results) if ok]
+        started = await asyncio.gather(*(_start_pipeline(row["id"]) for row in saved_rows))
+        await asyncio.gather(*(
+            _fail_unstarted_project(row) for row, ok in zip(saved_rows, started) if not ok
+        ))
+
+# ===== КЭШ ПЛАНОВ =====
+# Планы меняются редко: несколько секунд устаревания допустимы,
+# а сброс кэша происходит при сохранении нового плана
+PLANS_CACHE_TTL = 5.0
+_PLANS_CACHE = {"data": None, "ts": 0.0, "version": 0}
+
+# Отрендеренный список планов живет до смены версии кэша планов
+_LIST_PLANS_RENDERED = {"text": None, "version": -1}
+
+async def cached_get_plans():
+    """Возвращает активные планы, обращаясь к БД не чаще раза в PLANS_CACHE_TTL"""
+    if _PLANS_CACHE["data"] is not None and time.monotonic() - _PLANS_CACHE["ts"] < PLANS_CACHE_TTL:
+        return _PLANS_CACHE["data"]
+    
+    plans = await aget_plans(is_active=True)
+    _PLANS_CACHE["data"] = plans
+    _PLANS_CACHE["ts"] = time.monotonic()
+    _PLANS_CACHE["version"] += 1
+    return plans
+
+# Отдельные планы по ID: тот же TTL, отсутствующие ID не кэшируются
+PLAN_CACHE_SIZE = 128
+# Порядок записей — порядок обращений: при переполнении вытесняется
+# план, который дольше всех не запрашивали (LRU)
+_PLAN_BY_ID_CACHE = OrderedDict()
+
+async def cached_get_plan(plan_id: int):
+    """Возвращает план по ID, обращаясь к БД не чаще раза в PLANS_CACHE_TTL"""
+    cached = _PLAN_BY_ID_CACHE.get(plan_id)
+    if cached is not None and time.monotonic() - cached[0] < PLANS_CACHE_TTL:
+        _PLAN_BY_ID_CACHE.move_to_end(plan_id)
+        return cached[1]
+    
+    plan = await aget_plan(plan_id)
+    if plan is not None:
+        _PLAN_BY_ID_CACHE[plan_id] = (time.monotonic(), plan)
+        _PLAN_BY_ID_CACHE.move_to_end(plan_id)
+        if len(_PLAN_BY_ID_CACHE) > PLAN_CACHE_SIZE:
+            _PLAN_BY_ID_CACHE.popitem(last=False)
+    return plan
+
+def invalidate_plans_cache():
+    """Сбрасывает кэш планов после изменений"""
+    _PLANS_CACHE["ts"] = 0.0
+    _PLANS_CACHE["version"] += 1
+    _PLAN_BY_ID_CACHE.clear()
 
 # ===== ОСНОВНЫЕ КОМАНДЫ =====
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📹 Новое видео", callback_data="new_video")],
-        [InlineKeyboardButton(text="📋 Управление планами", callback_data="manage_plans")],
-        [InlineKeyboardButton(text="📊 Мои проекты", callback_data="my_projects")],
-        [InlineKeyboardButton(text="❓ Помощь", callback_data="help")]
-    ])
-    
-    await message.answer(
-        "👋 Привет! Я помогу превратить YouTube видео в увлекательные рассказы.\n\n"
-        "🎯 Что я умею:\n"
-        "• Скачиваю видео и извлекаю текст\n"
-        "• Создаю из него захватывающий рассказ (80-100 минут)\n"
-        "• Озвучиваю через Yandex SpeechKit\n"
-        "• Сохраняю на Яндекс.Диск\n\n"
-        "🎨 Использую двойную обработку Claude AI для максимального качества\n\n"
-        "Выберите действие:",
-        reply_markup=keyboard
-    )
+    await message.answer(_START_TEXT, reply_markup=START_KEYBOARD)
 
 # ===== УПРАВЛЕНИЕ ПЛАНАМИ =====
-@dp.callback_query(lambda c: c.data == "manage_plans")
+@dp.callback_query(F.data == "manage_plans")
 async def manage_plans_callback(callback: CallbackQuery):
-    plans = get_plans(is_active=True)
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="➕ Создать новый план", callback_data="create_plan")],
-        [InlineKeyboardButton(text="📋 Список планов", callback_data="list_plans")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-    ])
+    plans = await cached_get_plans()
     
     await callback.message.edit_text(
-        f"📋 *Управление планами обработки*\n\n"
-        f"Активных планов: {len(plans)}\n\n"
-        f"Планы определяют, как видео превращается в рассказ",
+        _MANAGE_PLANS_TEXT.format_map({"count": len(plans)}),
         parse_mode="Markdown",
-        reply_markup=keyboard
+        reply_markup=MANAGE_PLANS_KEYBOARD
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "create_plan")
+@dp.callback_query(F.data == "create_plan")
 async def create_plan_start(callback: CallbackQuery, state: FSMContext):
-    user_id = callback.from_user.id
-    plan_creation_data[user_id] = {}
-    
     await callback.message.edit_text(
         "📝 *Создание нового плана*\n\n"
         "Шаг 1/5: Введите название плана\n\n"
@@ -189,13 +475,13 @@ async def create_plan_start(callback: CallbackQuery, state: FSMContext):
         parse_mode="Markdown"
     )
     
-    await state.set_state(PlanCreationStates.entering_name)
+    # Новый черновик: сбрасываем данные предыдущего
+    await state.set_state(PlanCreationStates.entering)
+    await state.set_data({"step": STEP_NAME})
     await callback.answer()
 
-@dp.message(PlanCreationStates.entering_name)
 async def process_plan_name(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    plan_creation_data[user_id]["name"] = message.text
+    await state.update_data(name=message.text, step=STEP_DESCRIPTION)
     
     await message.answer(
         f"✅ Название: *{message.text}*\n\n"
@@ -203,163 +489,115 @@ async def process_plan_name(message: types.Message, state: FSMContext):
         f"Опишите, для каких видео подходит этот план:",
         parse_mode="Markdown"
     )
-    
-    await state.set_state(PlanCreationStates.entering_description)
 
-@dp.message(PlanCreationStates.entering_description)
 async def process_plan_description(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    plan_creation_data[user_id]["description"] = message.text
+    await state.update_data(description=message.text, step=STEP_TYPE)
     
     # Показываем типы планов
-    builder = InlineKeyboardBuilder()
-    
-    for template_id, template_info in PLAN_TEMPLATES.items():
-        builder.row(
-            InlineKeyboardButton(
-                text=template_info["name"],
-                callback_data=f"template_{template_id}"
-            )
-        )
-    
-    builder.row(
-        InlineKeyboardButton(
-            text="✏️ Свой промпт",
-            callback_data="custom_prompt"
-        )
-    )
-    
     await message.answer(
         "Шаг 3/5: Выберите тип плана\n\n"
         "Это определит, как будет обрабатываться текст:",
-        reply_markup=builder.as_markup()
+        reply_markup=TEMPLATES_KEYBOARD
     )
-    
-    await state.set_state(PlanCreationStates.selecting_type)
 
-@dp.callback_query(lambda c: c.data.startswith("template_"))
-async def process_template_selection(callback: CallbackQuery, state: FSMContext):
-    template_id = callback.data.split("_")[1]
-    user_id = callback.from_user.id
+@dp.callback_query(TplCB.filter())
+async def process_template_selection(callback: CallbackQuery, callback_data: TplCB, state: FSMContext):
+    template_id = callback_data.id
     
     template = PLAN_TEMPLATES[template_id]
-    plan_creation_data[user_id]["template"] = template_id
-    plan_creation_data[user_id]["prompt_template"] = template["prompt_template"]
+    await state.update_data(
+        template=template_id,
+        prompt_template=template["prompt_template"],
+        step=STEP_VOICE
+    )
     
     # Настройки голоса
-    builder = InlineKeyboardBuilder()
-    voices = {
-        "alena": "👩 Алёна (нейтральный)",
-        "jane": "👩 Джейн (эмоциональный)",
-        "omazh": "👨 Омаж (мужской)"
-    }
-    
-    for voice_id, voice_name in voices.items():
-        builder.row(
-            InlineKeyboardButton(
-                text=voice_name,
-                callback_data=f"voice_{voice_id}"
-            )
-        )
-    
     await callback.message.edit_text(
         f"Выбран шаблон: *{template['name']}*\n\n"
         f"Шаг 4/5: Выберите голос для озвучки:",
         parse_mode="Markdown",
-        reply_markup=builder.as_markup()
+        reply_markup=VOICE_KEYBOARD_FULL
     )
-    
-    await state.set_state(PlanCreationStates.entering_voice_settings)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "custom_prompt")
+@dp.callback_query(F.data == "custom_prompt")
 async def custom_prompt_start(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text(
-        "✏️ *Свой промпт для первого Claude*\n\n"
-        "Введите промпт, который будет использоваться для создания плана рассказа.\n\n"
-        "Используйте переменные:\n"
-        "• `{text}` - транскрипция видео\n"
-        "• `{target_words}` - целевое количество слов\n\n"
-        "Отправьте промпт следующим сообщением:",
-        parse_mode="Markdown"
-    )
+    await callback.message.edit_text(_CUSTOM_PROMPT_TEXT, parse_mode="Markdown")
     
-    await state.set_state(PlanCreationStates.entering_custom_prompt)
+    await state.update_data(step=STEP_CUSTOM_PROMPT)
     await callback.answer()
 
-@dp.message(PlanCreationStates.entering_custom_prompt)
 async def process_custom_prompt(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    plan_creation_data[user_id]["prompt_template"] = message.text
-    plan_creation_data[user_id]["template"] = "custom"
+    await state.update_data(prompt_template=message.text, template="custom", step=STEP_VOICE)
     
     # Переходим к выбору голоса
-    builder = InlineKeyboardBuilder()
-    voices = {
-        "alena": "👩 Алёна",
-        "jane": "👩 Джейн", 
-        "omazh": "👨 Омаж"
-    }
-    
-    for voice_id, voice_name in voices.items():
-        builder.row(
-            InlineKeyboardButton(
-                text=voice_name,
-                callback_data=f"voice_{voice_id}"
-            )
-        )
-    
     await message.answer(
         "Шаг 4/5: Выберите голос для озвучки:",
-        reply_markup=builder.as_markup()
+        reply_markup=VOICE_KEYBOARD_SHORT
     )
-    
-    await state.set_state(PlanCreationStates.entering_voice_settings)
 
-@dp.callback_query(lambda c: c.data.startswith("voice_"))
-async def process_voice_selection(callback: CallbackQuery, state: FSMContext):
-    voice_id = callback.data.split("_")[1]
-    user_id = callback.from_user.id
+# Текстовые шаги создания плана; остальные шаги выполняются кнопками
+STEP_HANDLERS = {
+    STEP_NAME: process_plan_name,
+    STEP_DESCRIPTION: process_plan_description,
+    STEP_CUSTOM_PROMPT: process_custom_prompt
+}
+
+@dp.message(PlanCreationStates.entering)
+async def process_plan_step(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    handler = STEP_HANDLERS.get(data.get("step", STEP_NAME))
+    if handler:
+        await handler(message, state)
+
+@dp.callback_query(VoiceCB.filter())
+async def process_voice_selection(callback: CallbackQuery, callback_data: VoiceCB, state: FSMContext):
+    voice_id = callback_data.id
     
-    plan_creation_data[user_id]["voice"] = voice_id
+    await state.update_data(voice=voice_id, step=STEP_REVIEW)
     
     # Показываем финальный обзор
-    data = plan_creation_data[user_id]
+    draft = await get_plan_draft(state)
     
     review_text = f"""📋 *Обзор нового плана*
 
-*Название:* {data['name']}
-*Описание:* {data['description']}
-*Тип:* {PLAN_TEMPLATES.get(data.get('template', 'custom'), {}).get('name', 'Пользовательский')}
+*Название:* {draft.name}
+*Описание:* {draft.description}
+*Тип:* {PLAN_TEMPLATES.get(draft.template, {}).get('name', 'Пользовательский')}
 *Голос:* {voice_id}
 *Целевой объем:* {TARGET_WORDS} слов (~90 минут)
 
 Сохранить план?"""
     
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text="✅ Сохранить", callback_data="save_plan"),
-        InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_plan")
-    )
-    
     await callback.message.edit_text(
         review_text,
         parse_mode="Markdown",
-        reply_markup=builder.as_markup()
+        reply_markup=REVIEW_PLAN_KEYBOARD
     )
-    
-    await state.set_state(PlanCreationStates.reviewing_plan)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "save_plan")
+@dp.callback_query(F.data == "save_plan")
 async def save_plan_callback(callback: CallbackQuery, state: FSMContext):
-    user_id = callback.from_user.id
-    data = plan_creation_data[user_id]
+    # После FSM_TTL или по старой кнопке данных черновика уже нет:
+    # недостающие поля заполнились бы пустыми значениями по умолчанию
+    data = await state.get_data()
+    draft = _plan_draft_from_data(data)
+    if (
+        await state.get_state() != PlanCreationStates.entering.state
+        or data.get("step") != STEP_REVIEW
+        or not (draft.name and draft.prompt_template and draft.voice)
+    ):
+        await state.clear()
+        await callback.answer(
+            "⌛ Черновик плана устарел. Начните создание плана заново.",
+            show_alert=True
+        )
+        return
     
     # Создаем структуру плана с двумя диалогами Claude
     plan_data = {
-        "name": data["name"],
-        "description": data["description"],
+        "name": draft.name,
+        "description": draft.description,
         "text_steps": [
             {
                 "type": "extract_audio",
@@ -375,7 +613,7 @@ async def save_plan_callback(callback: CallbackQuery, state: FSMContext):
             {
                 "type": "create_story_plan",  # Первый Claude
                 "params": {
-                    "prompt": data["prompt_template"],
+                    "prompt": draft.prompt_template,
                     "model": "claude-3-sonnet-20240229",
                     "temperature": 0.7,
                     "target_words": TARGET_WORDS
@@ -392,61 +630,56 @@ async def save_plan_callback(callback: CallbackQuery, state: FSMContext):
             {
                 "type": "generate_speech",
                 "params": {
-                    "voice": data["voice"],
+                    "voice": draft.voice,
                     "emotion": "neutral",
                     "speed": 1.0
                 }
             }
         ],
         "video_steps": [],
-        "default_prompt": data["prompt_template"],
-        "default_voice": data["voice"],
+        "default_prompt": draft.prompt_template,
+        "default_voice": draft.voice,
         "is_active": True,
         "modules_enabled": ["text"],
         "metadata": {
             "target_words": TARGET_WORDS,
-            "template": data.get("template", "custom")
+            "template": draft.template
         }
     }
     
     # Сохраняем в БД
-    plan = create_plan(plan_data)
+    plan = await acreate_plan(plan_data)
+    invalidate_plans_cache()
     
     await callback.message.edit_text(
-        f"✅ План *{data['name']}* успешно создан!\n\n"
+        f"✅ План *{draft.name}* успешно создан!\n\n"
         f"ID плана: `{plan.id}`\n\n"
         f"Теперь вы можете использовать его для обработки видео.",
         parse_mode="Markdown"
     )
     
-    # Очищаем временные данные
-    del plan_creation_data[user_id]
+    # Очищаем временные данные вместе с черновиком
     await state.clear()
     
-    # Показываем главное меню
-    await asyncio.sleep(2)
-    await cmd_start(callback.message)
+    # Главное меню покажем через пару секунд, не удерживая обработчик
+    task = asyncio.create_task(_delayed_menu(callback.message.chat.id, 2.0))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
     await callback.answer()
 
 # ===== ОБРАБОТКА ВИДЕО =====
-@dp.callback_query(lambda c: c.data == "new_video")
+@dp.callback_query(F.data == "new_video")
 async def new_video_callback(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text(
-        "📹 Отправьте ссылку на YouTube видео:\n\n"
-        "Поддерживаются форматы:\n"
-        "• https://youtube.com/watch?v=...\n"
-        "• https://youtu.be/...\n"
-        "• https://m.youtube.com/watch?v=..."
-    )
+    await callback.message.edit_text(_NEW_VIDEO_TEXT)
     await state.set_state(VideoStates.waiting_for_url)
     await callback.answer()
 
 @dp.message(VideoStates.waiting_for_url)
 async def process_url(message: types.Message, state: FSMContext):
-    url = message.text
+    url = (message.text or "").strip()
     
     # Валидация URL
-    if not any(domain in url for domain in ["youtube.com", "youtu.be", "m.youtube.com"]):
+    if not is_youtube_url(url):
         await message.answer(
             "❌ Пожалуйста, отправьте корректную ссылку на YouTube видео"
         )
@@ -456,7 +689,7 @@ async def process_url(message: types.Message, state: FSMContext):
     await state.update_data(youtube_url=url)
     
     # Получаем активные планы
-    plans = get_plans(is_active=True)
+    plans = await cached_get_plans()
     
     if not plans:
         await message.answer(
@@ -489,7 +722,7 @@ async def process_url(message: types.Message, state: FSMContext):
         keyboard_buttons.append([
             InlineKeyboardButton(
                 text=button_text,
-                callback_data=f"plan_{plan.id}"
+                callback_data=PlanCB(id=plan.id).pack()
             )
         ])
     
@@ -508,11 +741,11 @@ async def process_url(message: types.Message, state: FSMContext):
 async def create_and_start_project(message: types.Message, state: FSMContext, plan_id: int, url: str):
     """Создает проект и запускает обработку"""
     
-    # Создаем проект
-    project_id = str(uuid.uuid4())
-    settings_obj = get_default_settings()
+    # Создаем проект: ULID упорядочен по времени, вставки идут в конец индекса
+    project_id = str(ULID())
+    settings_obj = await aget_default_settings()
     
-    project = create_project({
+    saved = queue_project({
         "id": project_id,
         "youtube_url": url,
         "plan_id": plan_id,
@@ -523,40 +756,54 @@ async def create_and_start_project(message: types.Message, state: FSMContext, pl
         "status": "created"
     })
     
-    # Сохраняем проект для пользователя
-    user_id = message.from_user.id
-    if user_id not in user_projects:
-        user_projects[user_id] = []
-    user_projects[user_id].append(project_id)
+    # Подтверждаем только записанный проект: буфер записи живет в памяти
+    if not await saved:
+        await message.answer("❌ Не удалось сохранить проект. Попробуйте еще раз.")
+        await state.clear()
+        return
     
-    await message.answer(
-        f"✅ Проект создан!\n"
-        f"ID: `{project_id}`\n\n"
-        f"🚀 Запускаю обработку...\n\n"
-        f"⏱ Примерное время: 80-100 минут\n"
-        f"📊 Вы получите уведомления о прогрессе",
-        parse_mode="Markdown"
+    # Сохранение проекта пользователя и подтверждение не зависят
+    # друг от друга — выполняем их одновременно
+    # Сбой Redis не должен прерывать обработчик: проект уже записан и запущен
+    stored, answered = await asyncio.gather(
+        add_user_project(message.from_user.id, project_id),
+        message.answer(
+            f"✅ Проект создан!\n"
+            f"ID: `{project_id}`\n\n"
+            f"🚀 Запускаю обработку...\n\n"
+            f"⏱ Примерное время: 80-100 минут\n"
+            f"📊 Вы получите уведомления о прогрессе",
+            parse_mode="Markdown"
+        ),
+        return_exceptions=True
     )
+    if isinstance(stored, Exception):
+        logger.error("Ошибка сохранения проекта %s пользователя: %s", project_id, stored)
+    if isinstance(answered, Exception):
+        logger.error("Ошибка отправки подтверждения проекта %s: %s", project_id, answered)
     
-    # Запускаем обработку через Celery
+    await state.clear()
+
+async def _start_pipeline(project_id: str) -> bool:
+    """Отправляет задачу обработки в Celery"""
     try:
         from workers.tasks.text_tasks import process_text_pipeline
-        process_text_pipeline.delay(project_id)
-        logger.info(f"Задача отправлена в Celery для проекта {project_id}")
-    except Exception as e:
-        logger.error(f"Ошибка при запуске задачи: {e}")
-        await message.answer(
-            "❌ Произошла ошибка при запуске обработки."
+        # Бот не читает результат задачи — не пишем его в result backend
+        await asyncio.to_thread(
+            process_text_pipeline.apply_async, args=[project_id], ignore_result=True
         )
-    
-    await state.clear()
+        logger.info("Задача отправлена в Celery для проекта %s", project_id)
+        return True
+    except Exception as e:
+        logger.error("Ошибка при запуске задачи: %s", e)
+        return False
 
-@dp.callback_query(lambda c: c.data.startswith("plan_"))
-async def select_plan_callback(callback: CallbackQuery, state: FSMContext):
-    plan_id = int(callback.data.split("_")[1])
+@dp.callback_query(PlanCB.filter())
+async def select_plan_callback(callback: CallbackQuery, callback_data: PlanCB, state: FSMContext):
+    plan_id = callback_data.id
     data = await state.get_data()
     
-    plan = get_plan(plan_id)
+    plan = await cached_get_plan(plan_id)
     await callback.message.edit_text(
         f"📋 Выбран план: *{plan.name}*\n\n"
         f"🚀 Запускаю обработку...",
@@ -568,9 +815,26 @@ async def select_plan_callback(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====
-@dp.callback_query(lambda c: c.data == "list_plans")
+def _render_plans_list(plans) -> str:
+    """Собирает Markdown-список планов"""
+    parts = ["📋 *Активные планы:*\n"]
+    
+    for i, plan in enumerate(plans, 1):
+        entry = f"{i}. *{plan.name}*\n   _{plan.description}_\n"
+        
+        # Показываем метаданные если есть
+        if plan.metadata:
+            template = plan.metadata.get("template", "custom")
+            if template in PLAN_TEMPLATES:
+                entry += f"   Тип: {PLAN_TEMPLATES[template]['name']}\n"
+        
+        parts.append(entry)
+    
+    return "\n".join(parts) + "\n"
+
+@dp.callback_query(F.data == "list_plans")
 async def list_plans_callback(callback: CallbackQuery):
-    plans = get_plans(is_active=True)
+    plans = await cached_get_plans()
     
     if not plans:
         await callback.message.edit_text(
@@ -580,75 +844,75 @@ async def list_plans_callback(callback: CallbackQuery):
         await callback.answer()
         return
     
-    text = "📋 *Активные планы:*\n\n"
-    
-    for i, plan in enumerate(plans, 1):
-        text += f"{i}. *{plan.name}*\n"
-        text += f"   _{plan.description}_\n"
-        
-        # Показываем метаданные если есть
-        if plan.metadata:
-            template = plan.metadata.get("template", "custom")
-            if template in PLAN_TEMPLATES:
-                text += f"   Тип: {PLAN_TEMPLATES[template]['name']}\n"
-        
-        text += "\n"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="➕ Создать новый", callback_data="create_plan")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-    ])
+    version = _PLANS_CACHE["version"]
+    if _LIST_PLANS_RENDERED["version"] != version:
+        _LIST_PLANS_RENDERED["text"] = _render_plans_list(plans)
+        _LIST_PLANS_RENDERED["version"] = version
+    text = _LIST_PLANS_RENDERED["text"]
     
     await callback.message.edit_text(
         text,
         parse_mode="Markdown",
-        reply_markup=keyboard
+        reply_markup=LIST_PLANS_KEYBOARD
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "main_menu")
+async def _send_main_menu(chat_id: int):
+    """Отправляет главное меню напрямую, минуя обработчик /start"""
+    await bot.send_message(chat_id, _START_TEXT, reply_markup=START_KEYBOARD)
+
+# Фоновые задачи держим ссылками, чтобы их не собрал GC до завершения
+_background_tasks = set()
+
+async def _delayed_menu(chat_id: int, delay: float):
+    # Задачу никто не ждет: без этого ошибка всплыла бы только
+    # как "Task exception was never retrieved"
+    try:
+        await asyncio.sleep(delay)
+        await _send_main_menu(chat_id)
+    except Exception:
+        logger.exception("Ошибка отправки главного меню в чат %s", chat_id)
+
+@dp.callback_query(F.data == "main_menu")
 async def main_menu_callback(callback: CallbackQuery):
-    await cmd_start(callback.message)
+    await _send_main_menu(callback.message.chat.id)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "cancel")
+@dp.callback_query(F.data == "cancel")
 async def cancel_callback(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text("❌ Операция отменена")
-    await cmd_start(callback.message)
+    await _send_main_menu(callback.message.chat.id)
     await callback.answer()
 
 # ===== ОБРАБОТЧИК ОШИБОК =====
 @dp.error()
 async def error_handler(event: types.ErrorEvent):
-    logger.error(f"Error in handler: {event.exception}")
+    logger.error("Error in handler: %s", event.exception)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("update=%r", event.update)
     
     if event.update.message:
         await event.update.message.answer(
             "❌ Произошла ошибка. Попробуйте позже."
         )
 
-# ===== ФУНКЦИЯ ДЛЯ УВЕДОМЛЕНИЙ =====
-async def notify_progress(chat_id: int, project_id: str, message: str):
-    """Отправляет уведомление о прогрессе обработки"""
-    try:
-        await bot.send_message(
-            chat_id,
-            f"📊 Проект `{project_id[:8]}...`\n{message}",
-            parse_mode="Markdown"
-        )
-    except Exception as e:
-        logger.error(f"Ошибка отправки уведомления: {e}")
-
 # ===== ЗАПУСК БОТА =====
 async def main():
     logger.info("Starting improved bot...")
     
-    # Удаляем вебхук если был установлен
-    await bot.delete_webhook(drop_pending_updates=True)
-    
-    # Запускаем polling
-    await dp.start_polling(bot)
+    try:
+        if settings.WEBHOOK_URL:
+            await run_webhook(dp, bot)
+        else:
+            # Без публичного адреса работаем через polling
+            await bot.delete_webhook(drop_pending_updates=True)
+            await poll_updates(dp, bot, polling_bot)
+    finally:
+        await flush_projects()
+        await dp.storage.close()
+        await polling_bot.session.close()
+        await bot.session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -2,27 +2,57 @@
 # Улучшенный Telegram бот с отображением процессов и созданием планов
 
 import asyncio
+import functools
 import logging
+import sys
+import time
+from dataclasses import asdict, dataclass, fields
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import uuid
-from datetime import datetime
 from typing import Dict, List, Optional
-import json
+from types import MappingProxyType
+import orjson
+from redis.asyncio import Redis
 
 from config.settings import settings
-from database.crud import create_project, get_plans, get_default_settings, get_project, create_plan
+from interfaces.telegram_bot.throttling import ThrottledBot
+from interfaces.telegram_bot.validators import is_youtube_url
+from interfaces.telegram_bot.runner import poll_updates, run_webhook
+from database.crud import create_project, get_plans, get_plan, get_default_settings, get_project, create_plan
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Инициализация бота
-bot = Bot(token=settings.TELEGRAM_TOKEN)
-dp = Dispatcher()
+def _json_dumps(value) -> str:
+    return orjson.dumps(value).decode()
+
+# Инициализация бота: исходящие запросы проходят через лимитер Telegram.
+# Ответы API и входящие webhook-обновления разбираются через orjson
+bot = ThrottledBot(
+    token=settings.TELEGRAM_TOKEN,
+    session=AiohttpSession(json_loads=orjson.loads, json_dumps=_json_dumps)
+)
+
+# Long-polling идет отдельным ботом со своим маленьким пулом и без лимитера:
+# пауза после 429 на исходящих не останавливает получение обновлений
+_polling_session = AiohttpSession(json_loads=orjson.loads, json_dumps=_json_dumps)
+_polling_session._connector_init.update(limit=settings.TELEGRAM_POLLING_POOL_LIMIT)
+polling_bot = Bot(token=settings.TELEGRAM_TOKEN, session=_polling_session)
+
+# Состояния FSM и процессы живут в Redis: бот можно запускать
+# в нескольких экземплярах и перезапускать без потери данных
+FSM_TTL = 30 * 60
+redis_client = Redis.from_url(settings.REDIS_URL, decode_responses=True)
+dp = Dispatcher(storage=RedisStorage(redis=redis_client, state_ttl=FSM_TTL, data_ttl=FSM_TTL))
 
 # ===== СОСТОЯНИЯ =====
 class VideoStates(StatesGroup):
@@ -39,41 +69,218 @@ class PlanCreationStates(StatesGroup):
     selecting_speed = State()
     confirming_plan = State()
 
+# ===== CALLBACK DATA =====
+class PlanCB(CallbackData, prefix="plan"):
+    action: str
+    plan_id: int
+
+class ProcCB(CallbackData, prefix="proc"):
+    action: str
+    project_id: str
+
+class TemplateCB(CallbackData, prefix="tpl"):
+    id: str
+
+class VoiceCB(CallbackData, prefix="voice"):
+    id: str
+
+class EmotionCB(CallbackData, prefix="emotion"):
+    id: str
+
 # ===== ХРАНИЛИЩА =====
-# Активные процессы: {user_id: {project_id: process_data}}
-active_processes = {}
+# Процесс — хэш proc:{user_id}:{project_id}, список процессов пользователя —
+# множество procs:{user_id}. Черновики планов хранятся в данных FSM
+PROCESS_TTL = 24 * 60 * 60
+
+# Этапы обработки и статусы интернируем: они повторяются в каждом процессе
+STAGES = tuple(sys.intern(stage) for stage in (
+    "downloading", "transcribing", "processing", "generating_speech", "uploading"
+))
+WAITING = sys.intern("waiting")
+
+@dataclass(slots=True)
+class ProcessStatus:
+    """Состояние процесса; в Redis хранится как хэш"""
+    url: str = ""
+    plan_id: int = 0
+    plan_name: str = "Стандартный"
+    status: str = WAITING
+    started_at: str = ""
+    current_info: str = ""
+    result_url: str = ""
+    status_message_id: int = 0
+    
+    # Статусы этапов
+    downloading: str = WAITING
+    transcribing: str = WAITING
+    processing: str = WAITING
+    generating_speech: str = WAITING
+    uploading: str = WAITING
+    
+    # Длительность завершенных этапов
+    downloading_time: str = ""
+    transcribing_time: str = ""
+    processing_time: str = ""
+    generating_speech_time: str = ""
+    uploading_time: str = ""
+    
+    @classmethod
+    def from_hash(cls, data: Dict) -> "ProcessStatus":
+        values = {}
+        for name, field_type in _PROCESS_FIELD_TYPES.items():
+            if name in data:
+                value = data[name]
+                values[name] = int(value) if field_type is int else sys.intern(value)
+        return cls(**values)
+    
+    def to_hash(self) -> Dict:
+        return asdict(self)
+
+_PROCESS_FIELD_TYPES = {f.name: f.type for f in fields(ProcessStatus)}
+
+def _process_key(user_id: int, project_id: str) -> str:
+    return f"proc:{user_id}:{project_id}"
+
+def _user_processes_key(user_id: int) -> str:
+    return f"procs:{user_id}"
+
+async def save_process(user_id: int, project_id: str, process: ProcessStatus):
+    """Сохраняет новый процесс пользователя"""
+    key = _process_key(user_id, project_id)
+    index_key = _user_processes_key(user_id)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hset(key, mapping=process.to_hash())
+        pipe.expire(key, PROCESS_TTL)
+        pipe.sadd(index_key, project_id)
+        pipe.expire(index_key, PROCESS_TTL)
+        await pipe.execute()
+
+# Проверка и запись одной командой: между EXISTS и HSET ключ может истечь,
+# и HSET создал бы хэш без TTL, который уже никогда не удалится
+_UPDATE_PROCESS_SCRIPT = redis_client.register_script("""
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    redis.call("HSET", KEYS[1], unpack(ARGV))
+    return 1
+end
+return 0
+""")
+
+async def update_process(user_id: int, project_id: str, **changes):
+    """Обновляет поля процесса, если он еще существует"""
+    args = [item for pair in changes.items() for item in pair]
+    await _UPDATE_PROCESS_SCRIPT(keys=[_process_key(user_id, project_id)], args=args)
 
-# Проекты пользователей
-user_projects = {}
+async def get_process(user_id: int, project_id: str) -> Optional[ProcessStatus]:
+    data = await redis_client.hgetall(_process_key(user_id, project_id))
+    return ProcessStatus.from_hash(data) if data else None
 
-# Временные данные создания плана
-plan_drafts = {}
+async def get_user_processes(user_id: int) -> Dict[str, ProcessStatus]:
+    """Возвращает {project_id: process_data} одним пайплайном"""
+    project_ids = sorted(await redis_client.smembers(_user_processes_key(user_id)))
+    if not project_ids:
+        return {}
+    
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for project_id in project_ids:
+            pipe.hgetall(_process_key(user_id, project_id))
+        results = await pipe.execute()
+    
+    processes = {}
+    expired = []
+    for project_id, process_data in zip(project_ids, results):
+        if process_data:
+            processes[project_id] = ProcessStatus.from_hash(process_data)
+        else:
+            expired.append(project_id)
+    
+    # Хэши истекших процессов уже удалены — чистим индекс
+    if expired:
+        await redis_client.srem(_user_processes_key(user_id), *expired)
+    
+    return processes
+
+# ===== КЭШ ПЛАНОВ =====
+def async_ttl_cache(ttl: float):
+    """Кэширует результат корутины на ttl секунд по её аргументам"""
+    def decorator(func):
+        cache = {}
+        lock = asyncio.Lock()
+        
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            entry = cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            
+            # Одновременные промахи ждут один запрос к БД
+            async with lock:
+                entry = cache.get(key)
+                if entry and entry[0] > time.monotonic():
+                    return entry[1]
+                
+                value = await func(*args, **kwargs)
+                # None (например, план с таким ID не найден) не кэшируем
+                if value is not None:
+                    cache[key] = (time.monotonic() + ttl, value)
+                return value
+        
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    
+    return decorator
+
+# CRUD синхронный: выполняем его в пуле потоков, чтобы не блокировать event loop
+@async_ttl_cache(ttl=30)
+async def get_plans_cached(is_active: bool = True):
+    return await asyncio.to_thread(get_plans, is_active=is_active)
+
+@async_ttl_cache(ttl=30)
+async def aget_plan(plan_id: int):
+    return await asyncio.to_thread(get_plan, plan_id)
+
+async def acreate_plan(plan_dict: dict):
+    return await asyncio.to_thread(create_plan, plan_dict)
+
+def invalidate_plans_cache():
+    """Сбрасывает кэш планов после создания или изменения плана"""
+    get_plans_cached.cache_clear()
+    aget_plan.cache_clear()
 
 # ===== ЭМОДЗИ И СТАТУСЫ =====
-STAGE_EMOJIS = {
-    "waiting": "⏳",
-    "downloading": "📥",
-    "transcribing": "📝",
-    "processing": "🤖",
-    "generating_speech": "🎙",
-    "uploading": "☁️",
-    "completed": "✅",
-    "failed": "❌"
-}
+# Единая таблица статусов: (ключ, эмодзи, название)
+_STAGE_TABLE = (
+    ("waiting", "⏳", "Ожидание"),
+    ("downloading", "📥", "Загрузка видео"),
+    ("transcribing", "📝", "Транскрибация"),
+    ("processing", "🤖", "Обработка текста"),
+    ("generating_speech", "🎙", "Создание озвучки"),
+    ("uploading", "☁️", "Загрузка на диск"),
+    ("completed", "✅", "Завершено"),
+    ("failed", "❌", "Ошибка")
+)
 
-STAGE_NAMES = {
-    "waiting": "Ожидание",
-    "downloading": "Загрузка видео",
-    "transcribing": "Транскрибация",
-    "processing": "Обработка текста",
-    "generating_speech": "Создание озвучки",
-    "uploading": "Загрузка на диск",
-    "completed": "Завершено",
-    "failed": "Ошибка"
-}
+# Неизменяемые представления; строки интернированы и общие для всех мест отображения
+STAGE_EMOJIS = MappingProxyType({
+    sys.intern(key): sys.intern(emoji) for key, emoji, _ in _STAGE_TABLE
+})
+STAGE_NAMES = MappingProxyType({
+    sys.intern(key): sys.intern(name) for key, _, name in _STAGE_TABLE
+})
+
+# ===== РЕДАКТИРОВАНИЕ СООБЩЕНИЙ =====
+# Ответы 429 повторяет ThrottledBot, здесь только пропуск пустой правки
+async def safe_edit(message: types.Message, text: str, **kwargs):
+    """Редактирует сообщение и молча пропускает правку, если текст и клавиатура не изменились"""
+    try:
+        return await message.edit_text(text, **kwargs)
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return None
+        raise
 
 # ===== ГЛАВНОЕ МЕНЮ =====
-def get_main_menu() -> InlineKeyboardMarkup:
+def _build_main_menu() -> InlineKeyboardMarkup:
     """Создает главное меню"""
     builder = InlineKeyboardBuilder()
     
@@ -91,6 +298,49 @@ def get_main_menu() -> InlineKeyboardMarkup:
     
     return builder.as_markup()
 
+def _build_choice_keyboard(options, callback_factory) -> InlineKeyboardMarkup:
+    """Клавиатура выбора: по одной кнопке (название, id) в строке"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=name, callback_data=callback_factory(id=option_id).pack())]
+        for name, option_id in options
+    ])
+
+# Статические клавиатуры не зависят от пользователя — собираем их один раз
+MAIN_MENU_MARKUP = _build_main_menu()
+
+BACK_TO_MENU_MARKUP = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+])
+
+TEMPLATES_MARKUP = _build_choice_keyboard([
+    ("📖 Сторителлинг", "storytelling"),
+    ("🎓 Образовательный", "educational"),
+    ("⚡ Динамичный", "dynamic"),
+    ("🎭 Развлекательный", "entertainment"),
+    ("✍️ Свой промпт", "custom")
+], TemplateCB)
+
+VOICES_MARKUP = _build_choice_keyboard([
+    ("👩 Алёна", "alena"),
+    ("👨 Филипп", "filipp"),
+    ("👨 Ермил", "ermil"),
+    ("👩 Джейн", "jane"),
+    ("👨 Мадирус", "madirus"),
+    ("👩 Омаж", "omazh"),
+    ("👨 Захар", "zahar")
+], VoiceCB)
+
+EMOTIONS_MARKUP = _build_choice_keyboard([
+    ("😐 Нейтральная", "neutral"),
+    ("😊 Радостная", "good"),
+    ("😠 Раздраженная", "evil")
+], EmotionCB)
+
+CONFIRM_PLAN_MARKUP = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="✅ Сохранить план", callback_data="save_plan"),
+    InlineKeyboardButton(text="❌ Отменить", callback_data="cancel")
+]])
+
 # ===== КОМАНДА START =====
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
@@ -102,73 +352,83 @@ async def cmd_start(message: types.Message):
         "• Загрузка результатов на Яндекс.Диск\n\n"
         "Выберите действие:",
         parse_mode="Markdown",
-        reply_markup=get_main_menu()
+        reply_markup=MAIN_MENU_MARKUP
     )
 
 # ===== ОТОБРАЖЕНИЕ ПРОЦЕССОВ =====
-def format_process_status(project_id: str, process_data: Dict) -> str:
+# Все 21 вариант полосы прогресса (0-20 делений) строим один раз
+PROGRESS_BAR_WIDTH = 20
+PROGRESS_BARS = tuple(
+    "█" * i + "░" * (PROGRESS_BAR_WIDTH - i)
+    for i in range(PROGRESS_BAR_WIDTH + 1)
+)
+
+# (этап, название этапа, атрибут с длительностью этапа): название зависит
+# только от этапа, поэтому при отрисовке остается один поиск — эмодзи статуса
+_STAGE_ORDER = tuple(
+    (stage, STAGE_NAMES.get(stage, stage), f"{stage}_time")
+    for stage in STAGES
+)
+_DEFAULT_STAGE_EMOJI = "⏳"
+
+def _stage_suffix(process_data: ProcessStatus, status: str, time_attr: str) -> str:
+    """Время завершенного этапа или пометка о текущем"""
+    if status == "completed":
+        stage_time = getattr(process_data, time_attr, "")
+        return f" ({stage_time})" if stage_time else ""
+    if status == "processing":
+        return " (в процессе...)"
+    return ""
+
+def format_process_status(project_id: str, process_data: ProcessStatus) -> str:
     """Форматирует статус процесса для отображения"""
     stages = [
-        ("downloading", process_data.get("downloading", "waiting")),
-        ("transcribing", process_data.get("transcribing", "waiting")),
-        ("processing", process_data.get("processing", "waiting")),
-        ("generating_speech", process_data.get("generating_speech", "waiting")),
-        ("uploading", process_data.get("uploading", "waiting"))
+        (name, getattr(process_data, stage, WAITING), time_attr)
+        for stage, name, time_attr in _STAGE_ORDER
     ]
     
     # Заголовок
-    text = f"📌 *Проект:* `{project_id[:8]}...`\n"
-    text += f"🔗 *URL:* {process_data.get('url', 'Неизвестно')}\n"
-    text += f"📋 *План:* {process_data.get('plan_name', 'Стандартный')}\n\n"
+    parts = [
+        f"📌 *Проект:* `{project_id[:8]}...`\n",
+        f"🔗 *URL:* {process_data.url or 'Неизвестно'}\n",
+        f"📋 *План:* {process_data.plan_name}\n\n"
+    ]
     
     # Прогресс бар
-    completed_stages = sum(1 for _, status in stages if status == "completed")
-    total_stages = len(stages)
-    progress = completed_stages / total_stages
-    
-    progress_bar = "["
-    filled = int(progress * 20)
-    progress_bar += "█" * filled + "░" * (20 - filled)
-    progress_bar += f"] {int(progress * 100)}%"
-    
-    text += f"*Прогресс:* {progress_bar}\n\n"
+    completed_stages = sum(1 for _, status, _ in stages if status == "completed")
+    progress = completed_stages / len(stages)
+    filled = int(progress * PROGRESS_BAR_WIDTH)
+    parts.append(f"*Прогресс:* [{PROGRESS_BARS[filled]}] {int(progress * 100)}%\n\n")
     
     # Этапы
-    text += "*Этапы обработки:*\n"
-    for stage_key, status in stages:
-        emoji = STAGE_EMOJIS.get(status, "⏳")
-        name = STAGE_NAMES.get(stage_key, stage_key)
-        
-        # Добавляем время если есть
-        time_info = ""
-        if status == "completed" and f"{stage_key}_time" in process_data:
-            time_info = f" ({process_data[f'{stage_key}_time']})"
-        elif status == "processing":
-            time_info = " (в процессе...)"
-        
-        text += f"{emoji} {name}{time_info}\n"
+    parts.append("*Этапы обработки:*\n")
+    parts.append("".join(
+        f"{STAGE_EMOJIS.get(status, _DEFAULT_STAGE_EMOJI)} {name}{_stage_suffix(process_data, status, time_attr)}\n"
+        for name, status, time_attr in stages
+    ))
     
     # Дополнительная информация
-    if process_data.get("current_info"):
-        text += f"\n💬 {process_data['current_info']}"
+    if process_data.current_info:
+        parts.append(f"\n💬 {process_data.current_info}")
     
     # Время начала
-    if process_data.get("started_at"):
-        text += f"\n\n🕐 Начато: {process_data['started_at']}"
+    if process_data.started_at:
+        parts.append(f"\n\n🕐 Начато: {process_data.started_at}")
     
-    return text
+    return "".join(parts)
 
-@dp.callback_query(F.data == "my_processes")
-async def show_my_processes(callback: CallbackQuery):
+async def show_my_processes(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
+    processes = await get_user_processes(user_id)
     
-    if user_id not in active_processes or not active_processes[user_id]:
-        await callback.message.edit_text(
+    if not processes:
+        await safe_edit(
+            callback.message,
             "📊 *Активные процессы*\n\n"
             "У вас нет активных процессов обработки.\n"
             "Нажмите '📹 Новое видео' чтобы начать.",
             parse_mode="Markdown",
-            reply_markup=get_main_menu()
+            reply_markup=MAIN_MENU_MARKUP
         )
         return
     
@@ -177,18 +437,18 @@ async def show_my_processes(callback: CallbackQuery):
     
     builder = InlineKeyboardBuilder()
     
-    for project_id, process_data in active_processes[user_id].items():
-        status = process_data.get("status", "unknown")
+    for project_id, process_data in processes.items():
+        status = process_data.status
         emoji = STAGE_EMOJIS.get(status, "❓")
         
         # Краткая информация
-        short_url = process_data.get("url", "")[:30] + "..."
+        short_url = process_data.url[:30] + "..."
         button_text = f"{emoji} {short_url}"
         
         builder.row(
             InlineKeyboardButton(
                 text=button_text,
-                callback_data=f"process_{project_id}"
+                callback_data=ProcCB(action="view", project_id=project_id).pack()
             )
         )
     
@@ -197,48 +457,49 @@ async def show_my_processes(callback: CallbackQuery):
         InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")
     )
     
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         text,
         parse_mode="Markdown",
         reply_markup=builder.as_markup()
     )
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("process_"))
-async def show_process_details(callback: CallbackQuery):
-    project_id = callback.data.split("_")[1]
+@dp.callback_query(ProcCB.filter(F.action == "view"))
+async def show_process_details(callback: CallbackQuery, callback_data: ProcCB):
+    project_id = callback_data.project_id
     user_id = callback.from_user.id
     
-    if user_id not in active_processes or project_id not in active_processes[user_id]:
+    process_data = await get_process(user_id, project_id)
+    if not process_data:
         await callback.answer("Процесс не найден", show_alert=True)
         return
     
-    process_data = active_processes[user_id][project_id]
     text = format_process_status(project_id, process_data)
     
     builder = InlineKeyboardBuilder()
     
     # Кнопки управления
-    if process_data.get("status") not in ["completed", "failed"]:
+    if process_data.status not in ["completed", "failed"]:
         builder.row(
-            InlineKeyboardButton(text="⏸ Пауза", callback_data=f"pause_{project_id}"),
-            InlineKeyboardButton(text="❌ Отменить", callback_data=f"cancel_{project_id}")
+            InlineKeyboardButton(text="⏸ Пауза", callback_data=ProcCB(action="pause", project_id=project_id).pack()),
+            InlineKeyboardButton(text="❌ Отменить", callback_data=ProcCB(action="cancel", project_id=project_id).pack())
         )
     
-    if process_data.get("status") == "completed":
+    if process_data.status == "completed":
         builder.row(
             InlineKeyboardButton(
                 text="📁 Открыть результаты",
-                url=process_data.get("result_url", "https://disk.yandex.ru")
+                url=process_data.result_url or "https://disk.yandex.ru"
             )
         )
     
     builder.row(
-        InlineKeyboardButton(text="🔄 Обновить", callback_data=f"refresh_{project_id}"),
         InlineKeyboardButton(text="◀️ Назад", callback_data="my_processes")
     )
     
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         text,
         parse_mode="Markdown",
         reply_markup=builder.as_markup()
@@ -246,13 +507,14 @@ async def show_process_details(callback: CallbackQuery):
     await callback.answer()
 
 # ===== МЕНЮ ПЛАНОВ =====
-@dp.callback_query(F.data == "plans_menu")
-async def show_plans_menu(callback: CallbackQuery):
-    plans = get_plans(is_active=True)
+async def show_plans_menu(callback: CallbackQuery, state: FSMContext):
+    plans = await get_plans_cached(is_active=True)
     
-    text = "📋 *Управление планами обработки*\n\n"
-    text += "Планы определяют, как будет обработан ваш контент.\n"
-    text += "Вы можете использовать готовые планы или создать свой.\n\n"
+    parts = [
+        "📋 *Управление планами обработки*\n\n"
+        "Планы определяют, как будет обработан ваш контент.\n"
+        "Вы можете использовать готовые планы или создать свой.\n\n"
+    ]
     
     builder = InlineKeyboardBuilder()
     
@@ -263,17 +525,17 @@ async def show_plans_menu(callback: CallbackQuery):
     
     # Список существующих планов
     if plans:
-        text += "*Доступные планы:*\n"
+        parts.append("*Доступные планы:*\n")
         for i, plan in enumerate(plans, 1):
-            text += f"{i}. {plan.name}\n"
+            parts.append(f"{i}. {plan.name}\n")
             builder.row(
                 InlineKeyboardButton(
                     text=f"👁 {plan.name}",
-                    callback_data=f"view_plan_{plan.id}"
+                    callback_data=PlanCB(action="view", plan_id=plan.id).pack()
                 ),
                 InlineKeyboardButton(
                     text="✏️",
-                    callback_data=f"edit_plan_{plan.id}"
+                    callback_data=PlanCB(action="edit", plan_id=plan.id).pack()
                 )
             )
     
@@ -281,20 +543,20 @@ async def show_plans_menu(callback: CallbackQuery):
         InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")
     )
     
-    await callback.message.edit_text(
-        text,
+    await safe_edit(
+        callback.message,
+        "".join(parts),
         parse_mode="Markdown",
         reply_markup=builder.as_markup()
     )
     await callback.answer()
 
 # ===== СОЗДАНИЕ ПЛАНА =====
-@dp.callback_query(F.data == "create_plan")
 async def start_plan_creation(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     
     # Инициализируем черновик плана
-    plan_drafts[user_id] = {
+    await state.set_data({
         "name": "",
         "description": "",
         "prompt": "",
@@ -302,9 +564,10 @@ async def start_plan_creation(callback: CallbackQuery, state: FSMContext):
         "emotion": "neutral",
         "speed": 1.0,
         "created_by": user_id
-    }
+    })
     
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "🆕 *Создание нового плана*\n\n"
         "Шаг 1/6: Введите название плана\n"
         "Например: _Динамичные истории_ или _Образовательный контент_\n\n"
@@ -319,11 +582,10 @@ async def start_plan_creation(callback: CallbackQuery, state: FSMContext):
 async def process_plan_name(message: types.Message, state: FSMContext):
     if message.text == "/cancel":
         await state.clear()
-        await message.answer("Создание плана отменено", reply_markup=get_main_menu())
+        await message.answer("Создание плана отменено", reply_markup=MAIN_MENU_MARKUP)
         return
     
-    user_id = message.from_user.id
-    plan_drafts[user_id]["name"] = message.text
+    await state.update_data(name=message.text)
     
     await message.answer(
         f"✅ Название: *{message.text}*\n\n"
@@ -338,32 +600,16 @@ async def process_plan_name(message: types.Message, state: FSMContext):
 async def process_plan_description(message: types.Message, state: FSMContext):
     if message.text == "/cancel":
         await state.clear()
-        await message.answer("Создание плана отменено", reply_markup=get_main_menu())
+        await message.answer("Создание плана отменено", reply_markup=MAIN_MENU_MARKUP)
         return
     
-    user_id = message.from_user.id
-    plan_drafts[user_id]["description"] = message.text
+    await state.update_data(description=message.text)
     
     # Показываем шаблоны промптов
-    builder = InlineKeyboardBuilder()
-    
-    templates = [
-        ("📖 Сторителлинг", "storytelling"),
-        ("🎓 Образовательный", "educational"),
-        ("⚡ Динамичный", "dynamic"),
-        ("🎭 Развлекательный", "entertainment"),
-        ("✍️ Свой промпт", "custom")
-    ]
-    
-    for name, template_id in templates:
-        builder.row(
-            InlineKeyboardButton(text=name, callback_data=f"template_{template_id}")
-        )
-    
     await message.answer(
         "Шаг 3/6: Выберите базовый шаблон промпта\n\n"
         "Вы сможете отредактировать его на следующем шаге",
-        reply_markup=builder.as_markup()
+        reply_markup=TEMPLATES_MARKUP
     )
     
     await state.set_state(PlanCreationStates.selecting_base_prompt)
@@ -391,21 +637,37 @@ PROMPT_TEMPLATES = {
 Используй яркие метафоры и сравнения. Расширь с интересными отступлениями до 20000 слов."""
 }
 
-@dp.callback_query(F.data.startswith("template_"))
-async def select_prompt_template(callback: CallbackQuery, state: FSMContext):
-    template_id = callback.data.split("_")[1]
-    user_id = callback.from_user.id
+CUSTOM_PROMPT_PLACEHOLDER = "Напишите свой промпт для обработки текста"
+
+# В сообщениях показываем только начало промпта; полный текст хранится в черновике
+PROMPT_PREVIEW_LIMIT = 500
+
+def _prompt_preview(prompt: str) -> str:
+    if len(prompt) <= PROMPT_PREVIEW_LIMIT:
+        return prompt
+    return prompt[:PROMPT_PREVIEW_LIMIT] + "..."
+
+PROMPT_TEMPLATE_PREVIEWS = {
+    template_id: _prompt_preview(prompt)
+    for template_id, prompt in PROMPT_TEMPLATES.items()
+}
+
+@dp.callback_query(TemplateCB.filter())
+async def select_prompt_template(callback: CallbackQuery, callback_data: TemplateCB, state: FSMContext):
+    template_id = callback_data.id
     
     if template_id == "custom":
-        prompt = "Напишите свой промпт для обработки текста"
+        prompt = preview = CUSTOM_PROMPT_PLACEHOLDER
     else:
         prompt = PROMPT_TEMPLATES.get(template_id, "")
+        preview = PROMPT_TEMPLATE_PREVIEWS.get(template_id, "")
     
-    plan_drafts[user_id]["prompt"] = prompt
+    await state.update_data(prompt=prompt)
     
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         f"Шаг 4/6: Отредактируйте промпт\n\n"
-        f"*Текущий промпт:*\n```\n{prompt}\n```\n\n"
+        f"*Текущий промпт:*\n```\n{preview}\n```\n\n"
         f"Отправьте отредактированный текст или /skip чтобы оставить как есть",
         parse_mode="Markdown"
     )
@@ -415,101 +677,75 @@ async def select_prompt_template(callback: CallbackQuery, state: FSMContext):
 
 @dp.message(StateFilter(PlanCreationStates.editing_prompt))
 async def process_prompt_edit(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    
     if message.text != "/skip":
-        plan_drafts[user_id]["prompt"] = message.text
+        await state.update_data(prompt=message.text)
     
     # Выбор голоса
-    builder = InlineKeyboardBuilder()
-    
-    voices = [
-        ("👩 Алёна", "alena"),
-        ("👨 Филипп", "filipp"),
-        ("👨 Ермил", "ermil"),
-        ("👩 Джейн", "jane"),
-        ("👨 Мадирус", "madirus"),
-        ("👩 Омаж", "omazh"),
-        ("👨 Захар", "zahar")
-    ]
-    
-    for name, voice_id in voices:
-        builder.row(
-            InlineKeyboardButton(text=name, callback_data=f"voice_{voice_id}")
-        )
-    
     await message.answer(
         "Шаг 5/6: Выберите голос для озвучки",
-        reply_markup=builder.as_markup()
+        reply_markup=VOICES_MARKUP
     )
     
     await state.set_state(PlanCreationStates.selecting_voice)
 
-@dp.callback_query(F.data.startswith("voice_"))
-async def select_voice(callback: CallbackQuery, state: FSMContext):
-    voice_id = callback.data.split("_")[1]
-    user_id = callback.from_user.id
+@dp.callback_query(VoiceCB.filter())
+async def select_voice(callback: CallbackQuery, callback_data: VoiceCB, state: FSMContext):
+    voice_id = callback_data.id
     
-    plan_drafts[user_id]["voice"] = voice_id
+    await state.update_data(voice=voice_id)
     
     # Выбор эмоции
-    builder = InlineKeyboardBuilder()
-    
-    emotions = [
-        ("😐 Нейтральная", "neutral"),
-        ("😊 Радостная", "good"),
-        ("😠 Раздраженная", "evil")
-    ]
-    
-    for name, emotion_id in emotions:
-        builder.row(
-            InlineKeyboardButton(text=name, callback_data=f"emotion_{emotion_id}")
-        )
-    
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "Шаг 6/6: Выберите эмоцию голоса",
-        reply_markup=builder.as_markup()
+        reply_markup=EMOTIONS_MARKUP
     )
     
     await state.set_state(PlanCreationStates.selecting_emotion)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("emotion_"))
-async def select_emotion_and_confirm(callback: CallbackQuery, state: FSMContext):
-    emotion_id = callback.data.split("_")[1]
-    user_id = callback.from_user.id
-    
-    plan_drafts[user_id]["emotion"] = emotion_id
+# Черновик живет в RedisStorage FSM_TTL секунд: старая кнопка может прийти
+# уже после того, как он истек
+_PLAN_DRAFT_KEYS = ("name", "description", "prompt", "voice", "emotion")
+
+async def _session_expired(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.answer("⌛ Сессия устарела. Начните заново.", show_alert=True)
+
+@dp.callback_query(EmotionCB.filter())
+async def select_emotion_and_confirm(callback: CallbackQuery, callback_data: EmotionCB, state: FSMContext):
+    emotion_id = callback_data.id
     
     # Показываем итоговый план для подтверждения
-    plan = plan_drafts[user_id]
-    
-    text = "📋 *Проверьте ваш план:*\n\n"
-    text += f"*Название:* {plan['name']}\n"
-    text += f"*Описание:* {plan['description']}\n"
-    text += f"*Голос:* {plan['voice']}\n"
-    text += f"*Эмоция:* {plan['emotion']}\n\n"
-    text += f"*Промпт:*\n```\n{plan['prompt'][:500]}...\n```"
+    plan = await state.update_data(emotion=emotion_id)
+    if any(plan.get(key) is None for key in _PLAN_DRAFT_KEYS):
+        await _session_expired(callback, state)
+        return
     
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text="✅ Сохранить план", callback_data="save_plan"),
-        InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_plan")
+    text = (
+        f"📋 *Проверьте ваш план:*\n\n"
+        f"*Название:* {plan['name']}\n"
+        f"*Описание:* {plan['description']}\n"
+        f"*Голос:* {plan['voice']}\n"
+        f"*Эмоция:* {plan['emotion']}\n\n"
+        f"*Промпт:*\n```\n{_prompt_preview(plan['prompt'])}\n```"
     )
     
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         text,
         parse_mode="Markdown",
-        reply_markup=builder.as_markup()
+        reply_markup=CONFIRM_PLAN_MARKUP
     )
     
     await state.set_state(PlanCreationStates.confirming_plan)
     await callback.answer()
 
-@dp.callback_query(F.data == "save_plan")
 async def save_plan(callback: CallbackQuery, state: FSMContext):
-    user_id = callback.from_user.id
-    plan_data = plan_drafts[user_id]
+    plan_data = await state.get_data()
+    if any(plan_data.get(key) is None for key in _PLAN_DRAFT_KEYS):
+        await _session_expired(callback, state)
+        return
     
     # Создаем структуру плана для БД
     plan_dict = {
@@ -553,33 +789,33 @@ async def save_plan(callback: CallbackQuery, state: FSMContext):
     
     try:
         # Сохраняем в БД
-        new_plan = create_plan(plan_dict)
+        new_plan = await acreate_plan(plan_dict)
+        invalidate_plans_cache()
         
-        await callback.message.edit_text(
+        await safe_edit(
+            callback.message,
             f"✅ *План успешно создан!*\n\n"
             f"Название: {plan_data['name']}\n"
             f"Теперь вы можете использовать его для обработки видео.",
             parse_mode="Markdown",
-            reply_markup=get_main_menu()
+            reply_markup=MAIN_MENU_MARKUP
         )
         
-        # Очищаем черновик
-        del plan_drafts[user_id]
-        
     except Exception as e:
         logger.error(f"Ошибка создания плана: {e}")
-        await callback.message.edit_text(
+        await safe_edit(
+            callback.message,
             "❌ Ошибка при создании плана. Попробуйте позже.",
-            reply_markup=get_main_menu()
+            reply_markup=MAIN_MENU_MARKUP
         )
     
     await state.clear()
     await callback.answer()
 
 # ===== ОБРАБОТКА ВИДЕО =====
-@dp.callback_query(F.data == "new_video")
 async def new_video_callback(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "📹 *Новая обработка видео*\n\n"
         "Отправьте ссылку на YouTube видео:\n\n"
         "Поддерживаемые форматы:\n"
@@ -593,10 +829,10 @@ async def new_video_callback(callback: CallbackQuery, state: FSMContext):
 
 @dp.message(StateFilter(VideoStates.waiting_for_url))
 async def process_url(message: types.Message, state: FSMContext):
-    url = message.text
+    url = (message.text or "").strip()
     
     # Валидация URL
-    if not any(domain in url for domain in ["youtube.com", "youtu.be", "m.youtube.com"]):
+    if not is_youtube_url(url):
         await message.answer(
             "❌ Пожалуйста, отправьте корректную ссылку на YouTube видео\n"
             "Пример: `https://youtube.com/watch?v=dQw4w9WgXcQ`",
@@ -608,13 +844,13 @@ async def process_url(message: types.Message, state: FSMContext):
     await state.update_data(youtube_url=url)
     
     # Получаем планы
-    plans = get_plans(is_active=True)
+    plans = await get_plans_cached(is_active=True)
     
     if not plans:
         await message.answer(
             "❌ Нет доступных планов обработки.\n"
             "Создайте план в меню '📋 Планы'",
-            reply_markup=get_main_menu()
+            reply_markup=MAIN_MENU_MARKUP
         )
         await state.clear()
         return
@@ -626,7 +862,7 @@ async def process_url(message: types.Message, state: FSMContext):
         builder.row(
             InlineKeyboardButton(
                 text=f"📋 {plan.name}",
-                callback_data=f"select_plan_{plan.id}"
+                callback_data=PlanCB(action="select", plan_id=plan.id).pack()
             )
         )
     
@@ -642,49 +878,74 @@ async def process_url(message: types.Message, state: FSMContext):
     
     await state.set_state(VideoStates.selecting_plan)
 
-@dp.callback_query(F.data.startswith("select_plan_"))
-async def select_plan_callback(callback: CallbackQuery, state: FSMContext):
-    plan_id = int(callback.data.split("_")[2])
-    data = await state.get_data()
+@dp.callback_query(PlanCB.filter(F.action == "select"))
+async def select_plan_callback(callback: CallbackQuery, callback_data: PlanCB, state: FSMContext):
+    plan_id = callback_data.plan_id
+    youtube_url = (await state.get_data()).get("youtube_url")
+    if youtube_url is None:
+        await _session_expired(callback, state)
+        return
+    
     user_id = callback.from_user.id
     
     # Создаем проект
-    project_id = str(uuid.uuid4())[:8]  # Короткий ID для удобства
+    project_id = uuid.uuid4().hex[:8]  # Короткий ID для удобства
     
     # Добавляем в активные процессы
-    if user_id not in active_processes:
-        active_processes[user_id] = {}
-    
-    active_processes[user_id][project_id] = {
-        "url": data["youtube_url"],
-        "plan_id": plan_id,
-        "plan_name": get_plan_name(plan_id),
-        "status": "waiting",
-        "started_at": datetime.now().strftime("%H:%M"),
-        "downloading": "waiting",
-        "transcribing": "waiting",
-        "processing": "waiting",
-        "generating_speech": "waiting",
-        "uploading": "waiting"
-    }
+    process_data = ProcessStatus(
+        url=youtube_url,
+        plan_id=plan_id,
+        plan_name=await get_plan_name(plan_id),
+        started_at=time.strftime("%H:%M")
+    )
+    await save_process(user_id, project_id, process_data)
     
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         f"✅ *Проект создан!*\n"
         f"ID: `{project_id}`\n\n"
         f"🚀 Обработка началась!\n\n"
-        f"Вы можете следить за прогрессом в разделе '📊 Мои процессы'",
+        f"Прогресс будет обновляться в сообщении ниже",
         parse_mode="Markdown",
-        reply_markup=get_main_menu()
+        reply_markup=MAIN_MENU_MARKUP
+    )
+    
+    # Статусное сообщение: его редактирует сама обработка на каждом этапе
+    status_message = await callback.message.answer(
+        format_process_status(project_id, process_data),
+        parse_mode="Markdown"
     )
+    await update_process(user_id, project_id, status_message_id=status_message.message_id)
     
     # Запускаем обработку (имитация для демонстрации)
-    asyncio.create_task(simulate_processing(user_id, project_id))
+    task = asyncio.create_task(simulate_processing(user_id, project_id, status_message.message_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
     
     await state.clear()
     await callback.answer()
 
 # ===== СИМУЛЯЦИЯ ОБРАБОТКИ =====
-async def simulate_processing(user_id: int, project_id: str):
+_background_tasks = set()
+
+async def push_process_status(user_id: int, project_id: str, message_id: int):
+    """Перерисовывает статусное сообщение процесса"""
+    process_data = await get_process(user_id, project_id)
+    if not process_data:
+        return
+    
+    try:
+        await bot.edit_message_text(
+            format_process_status(project_id, process_data),
+            chat_id=user_id,
+            message_id=message_id,
+            parse_mode="Markdown"
+        )
+    except TelegramBadRequest as e:
+        # Сообщение удалено пользователем или текст не изменился
+        logger.warning(f"Не удалось обновить статус проекта {project_id}: {e}")
+
+async def simulate_processing(user_id: int, project_id: str, status_message_id: int):
     """Симулирует процесс обработки для демонстрации UI"""
     stages = [
         ("downloading", "Загружаю видео...", 5),
@@ -696,23 +957,24 @@ async def simulate_processing(user_id: int, project_id: str):
     
     for stage, info, duration in stages:
         # Обновляем статус
-        if user_id in active_processes and project_id in active_processes[user_id]:
-            active_processes[user_id][project_id]["status"] = stage
-            active_processes[user_id][project_id][stage] = "processing"
-            active_processes[user_id][project_id]["current_info"] = info
-            
-            # Ждем
-            await asyncio.sleep(duration)
-            
-            # Отмечаем как завершенное
-            active_processes[user_id][project_id][stage] = "completed"
-            active_processes[user_id][project_id][f"{stage}_time"] = f"{duration}с"
+        await update_process(user_id, project_id, status=stage, current_info=info, **{stage: "processing"})
+        await push_process_status(user_id, project_id, status_message_id)
+        
+        # Ждем
+        await asyncio.sleep(duration)
+        
+        # Отмечаем как завершенное
+        await update_process(user_id, project_id, **{stage: "completed", f"{stage}_time": f"{duration}с"})
     
     # Финальный статус
-    if user_id in active_processes and project_id in active_processes[user_id]:
-        active_processes[user_id][project_id]["status"] = "completed"
-        active_processes[user_id][project_id]["current_info"] = "Обработка завершена!"
-        active_processes[user_id][project_id]["result_url"] = "https://disk.yandex.ru/example"
+    if await redis_client.exists(_process_key(user_id, project_id)):
+        await update_process(
+            user_id, project_id,
+            status="completed",
+            current_info="Обработка завершена!",
+            result_url="https://disk.yandex.ru/example"
+        )
+        await push_process_status(user_id, project_id, status_message_id)
         
         # Отправляем уведомление
         try:
@@ -727,64 +989,55 @@ async def simulate_processing(user_id: int, project_id: str):
             pass
 
 # ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====
-def get_plan_name(plan_id: int) -> str:
+async def get_plan_name(plan_id: int) -> str:
     """Получает название плана по ID"""
     try:
-        from database.crud import get_plan
-        plan = get_plan(plan_id)
+        plan = await aget_plan(plan_id)
         return plan.name if plan else "Неизвестный план"
     except:
         return "Стандартный"
 
 # ===== ОБРАБОТЧИКИ КНОПОК =====
-@dp.callback_query(F.data == "main_menu")
-async def back_to_main_menu(callback: CallbackQuery):
-    await callback.message.edit_text(
+async def back_to_main_menu(callback: CallbackQuery, state: FSMContext):
+    await safe_edit(
+        callback.message,
         "👋 *Главное меню*\n\n"
         "Выберите действие:",
         parse_mode="Markdown",
-        reply_markup=get_main_menu()
+        reply_markup=MAIN_MENU_MARKUP
     )
     await callback.answer()
 
-@dp.callback_query(F.data == "cancel")
 async def cancel_action(callback: CallbackQuery, state: FSMContext):
     await state.clear()
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         "❌ Действие отменено",
-        reply_markup=get_main_menu()
+        reply_markup=MAIN_MENU_MARKUP
     )
     await callback.answer()
 
-@dp.callback_query(F.data == "refresh_processes")
-async def refresh_processes(callback: CallbackQuery):
-    await show_my_processes(callback)
-
-@dp.callback_query(F.data.startswith("refresh_"))
-async def refresh_process(callback: CallbackQuery):
-    # Обновляем конкретный процесс
-    await show_process_details(callback)
-
-@dp.callback_query(F.data.startswith("pause_"))
-async def pause_process(callback: CallbackQuery):
-    project_id = callback.data.split("_")[1]
+@dp.callback_query(ProcCB.filter(F.action == "pause"))
+async def pause_process(callback: CallbackQuery, callback_data: ProcCB):
     await callback.answer("⏸ Функция паузы будет доступна в следующей версии", show_alert=True)
 
-@dp.callback_query(F.data.startswith("cancel_"))
-async def cancel_process(callback: CallbackQuery):
-    project_id = callback.data.split("_")[1]
+@dp.callback_query(ProcCB.filter(F.action == "cancel"))
+async def cancel_process(callback: CallbackQuery, callback_data: ProcCB):
+    project_id = callback_data.project_id
     user_id = callback.from_user.id
     
-    if user_id in active_processes and project_id in active_processes[user_id]:
-        active_processes[user_id][project_id]["status"] = "failed"
-        active_processes[user_id][project_id]["current_info"] = "Отменено пользователем"
+    await update_process(user_id, project_id, status="failed", current_info="Отменено пользователем")
+    
+    process_data = await get_process(user_id, project_id)
+    if process_data and process_data.status_message_id:
+        await push_process_status(user_id, project_id, process_data.status_message_id)
     
     await callback.answer("❌ Процесс отменен", show_alert=True)
-    await show_process_details(callback)
+    await show_process_details(callback, callback_data)
 
-@dp.callback_query(F.data == "settings")
-async def show_settings(callback: CallbackQuery):
-    await callback.message.edit_text(
+async def show_settings(callback: CallbackQuery, state: FSMContext):
+    await safe_edit(
+        callback.message,
         "⚙️ *Настройки*\n\n"
         "Этот раздел находится в разработке.\n"
         "Здесь вы сможете:\n"
@@ -792,14 +1045,11 @@ async def show_settings(callback: CallbackQuery):
         "• Изменить параметры по умолчанию\n"
         "• Управлять интеграциями",
         parse_mode="Markdown",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-        ])
+        reply_markup=BACK_TO_MENU_MARKUP
     )
     await callback.answer()
 
-@dp.callback_query(F.data == "help")
-async def show_help(callback: CallbackQuery):
+async def show_help(callback: CallbackQuery, state: FSMContext):
     help_text = """
 ❓ *Помощь по использованию бота*
 
@@ -829,61 +1079,60 @@ async def show_help(callback: CallbackQuery):
 Если у вас возникли проблемы, обратитесь к администратору.
 """
     
-    await callback.message.edit_text(
+    await safe_edit(
+        callback.message,
         help_text,
         parse_mode="Markdown",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-        ])
+        reply_markup=BACK_TO_MENU_MARKUP
     )
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("view_plan_"))
-async def view_plan_details(callback: CallbackQuery):
-    plan_id = int(callback.data.split("_")[2])
+@dp.callback_query(PlanCB.filter(F.action == "view"))
+async def view_plan_details(callback: CallbackQuery, callback_data: PlanCB):
+    plan_id = callback_data.plan_id
     
     try:
-        from database.crud import get_plan
-        plan = get_plan(plan_id)
+        plan = await aget_plan(plan_id)
         
         if not plan:
             await callback.answer("План не найден", show_alert=True)
             return
         
         # Извлекаем информацию о промпте
-        claude_step = next(
-            (step for step in plan.text_steps if step["type"] == "process_with_claude"),
-            None
-        )
+        claude_step = plan.steps_by_type.get("process_with_claude")
+        speech_step = plan.steps_by_type.get("generate_speech")
         
-        speech_step = next(
-            (step for step in plan.text_steps if step["type"] == "generate_speech"),
-            None
-        )
-        
-        text = f"📋 *План: {plan.name}*\n\n"
-        text += f"*Описание:* {plan.description}\n\n"
+        parts = [
+            f"📋 *План: {plan.name}*\n\n"
+            f"*Описание:* {plan.description}\n\n"
+        ]
         
         if claude_step:
             prompt = claude_step["params"].get("prompt", "Не указан")
-            text += f"*Промпт для обработки:*\n```\n{prompt[:800]}{'...' if len(prompt) > 800 else ''}\n```\n\n"
+            parts.append(f"*Промпт для обработки:*\n```\n{prompt[:800]}{'...' if len(prompt) > 800 else ''}\n```\n\n")
         
         if speech_step:
-            text += f"*Параметры озвучки:*\n"
-            text += f"• Голос: {speech_step['params'].get('voice', 'alena')}\n"
-            text += f"• Эмоция: {speech_step['params'].get('emotion', 'neutral')}\n"
-            text += f"• Скорость: {speech_step['params'].get('speed', 1.0)}\n"
+            speech_params = speech_step["params"]
+            parts.append(
+                f"*Параметры озвучки:*\n"
+                f"• Голос: {speech_params.get('voice', 'alena')}\n"
+                f"• Эмоция: {speech_params.get('emotion', 'neutral')}\n"
+                f"• Скорость: {speech_params.get('speed', 1.0)}\n"
+            )
+        
+        text = "".join(parts)
         
         builder = InlineKeyboardBuilder()
         builder.row(
-            InlineKeyboardButton(text="✏️ Редактировать", callback_data=f"edit_plan_{plan_id}"),
-            InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_plan_{plan_id}")
+            InlineKeyboardButton(text="✏️ Редактировать", callback_data=PlanCB(action="edit", plan_id=plan_id).pack()),
+            InlineKeyboardButton(text="🗑 Удалить", callback_data=PlanCB(action="delete", plan_id=plan_id).pack())
         )
         builder.row(
             InlineKeyboardButton(text="◀️ Назад", callback_data="plans_menu")
         )
         
-        await callback.message.edit_text(
+        await safe_edit(
+            callback.message,
             text,
             parse_mode="Markdown",
             reply_markup=builder.as_markup()
@@ -895,14 +1144,34 @@ async def view_plan_details(callback: CallbackQuery):
     
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("edit_plan_"))
+@dp.callback_query(PlanCB.filter(F.action == "edit"))
 async def edit_plan(callback: CallbackQuery):
     await callback.answer("✏️ Редактирование планов будет доступно в следующей версии", show_alert=True)
 
-@dp.callback_query(F.data.startswith("delete_plan_"))
+@dp.callback_query(PlanCB.filter(F.action == "delete"))
 async def delete_plan(callback: CallbackQuery):
     await callback.answer("🗑 Удаление планов будет доступно в следующей версии", show_alert=True)
 
+# ===== ДИСПЕТЧЕР СТАТИЧНЫХ КНОПОК =====
+# Кнопки с постоянным callback_data обрабатываются одним фильтром
+# и поиском в словаре вместо цепочки фильтров F.data == "..."
+STATIC_HANDLERS = {
+    "main_menu": back_to_main_menu,
+    "my_processes": show_my_processes,
+    "refresh_processes": show_my_processes,
+    "plans_menu": show_plans_menu,
+    "new_video": new_video_callback,
+    "create_plan": start_plan_creation,
+    "save_plan": save_plan,
+    "cancel": cancel_action,
+    "settings": show_settings,
+    "help": show_help
+}
+
+@dp.callback_query(F.data.in_(STATIC_HANDLERS))
+async def static_callback(callback: CallbackQuery, state: FSMContext):
+    await STATIC_HANDLERS[callback.data](callback, state)
+
 # ===== ОБРАБОТЧИК ОШИБОК =====
 @dp.error()
 async def error_handler(event: types.ErrorEvent):
@@ -911,18 +1180,31 @@ async def error_handler(event: types.ErrorEvent):
     if event.update.message:
         await event.update.message.answer(
             "❌ Произошла ошибка. Попробуйте позже.",
-            reply_markup=get_main_menu()
+            reply_markup=MAIN_MENU_MARKUP
         )
 
 # ===== ЗАПУСК БОТА =====
 async def main():
     logger.info("Starting improved bot...")
     
-    # Удаляем вебхук если был установлен
-    await bot.delete_webhook(drop_pending_updates=True)
-    
-    # Запускаем polling
-    await dp.start_polling(bot)
+    try:
+        if settings.WEBHOOK_URL:
+            await run_webhook(dp, bot)
+        else:
+            # Без публичного адреса работаем через polling
+            await bot.delete_webhook(drop_pending_updates=True)
+            await poll_updates(dp, bot, polling_bot)
+    finally:
+        await dp.storage.close()
+        await polling_bot.session.close()
+        await bot.session.close()
 
 if __name__ == "__main__":
+    # uvloop ставится вместе с uvicorn[standard]; на Windows его нет
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
     asyncio.run(main())
\ No newline at end of file
@@ -1,14 +1,173 @@
 # interfaces/telegram_bot/notifications.py
+import asyncio
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramBadRequest
+from config.settings import settings
+from interfaces.telegram_bot.throttling import ThrottledBot
 
 logger = logging.getLogger(__name__)
 
-# Временно отключаем создание бота здесь
+# ===== БОТ ВОРКЕРА =====
+# Один бот на процесс воркера: keep-alive соединения к api.telegram.org
+# переиспользуются всеми уведомлениями, без TLS-рукопожатия на каждое
+WORKER_POOL_LIMIT = 20
+
 bot = None
 
+def _create_bot():
+    session = AiohttpSession(timeout=settings.TELEGRAM_POOL_TIMEOUT)
+    session._connector_init.update(limit=WORKER_POOL_LIMIT, ttl_dns_cache=300, keepalive_timeout=75)
+    return ThrottledBot(token=settings.TELEGRAM_TOKEN, session=session)
+
+def init_bot():
+    """Создает бота процесса (вызывается из worker_process_init или при первом уведомлении)"""
+    global bot
+    if bot is None:
+        bot = _create_bot()
+    return bot
+
+async def close_bot():
+    """Закрывает HTTP-сессию бота процесса"""
+    global bot
+    if bot is not None:
+        await bot.session.close()
+        bot = None
+
+def _get_bot():
+    return bot or init_bot()
+
+def _format_progress(project_id: str, message: str) -> str:
+    return f"📊 Проект `...{project_id[-8:]}`\n{message}"
+
+class ProgressNotifier:
+    """
+    Прогресс проекта показывается в одном статусном сообщении: первое
+    уведомление его создает, последующие только запоминают текст, а
+    фоновая задача раз в interval секунд применяет последний из них
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        # (chat_id, project_id) -> [message_id, latest_text, dirty]
+        self._statuses = {}
+        self._flush_task = None
+
+    async def update(self, chat_id: int, project_id: str, message: str):
+        key = (chat_id, project_id)
+        text = _format_progress(project_id, message)
+        status = self._statuses.get(key)
+
+        if status is None:
+            sent = await _get_bot().send_message(chat_id, text, parse_mode="Markdown")
+            self._statuses[key] = [sent.message_id, text, False]
+            return
+
+        status[1] = text
+        status[2] = True
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while any(status[2] for status in self._statuses.values()):
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        """Применяет накопленные тексты ко всем статусным сообщениям"""
+        for (chat_id, project_id), status in list(self._statuses.items()):
+            if not status[2]:
+                continue
+
+            status[2] = False
+            try:
+                await _get_bot().edit_message_text(
+                    status[1],
+                    chat_id=chat_id,
+                    message_id=status[0],
+                    parse_mode="Markdown"
+                )
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    logger.error(f"Ошибка обновления статуса проекта {project_id}: {e}")
+            except Exception as e:
+                logger.error(f"Ошибка обновления статуса проекта {project_id}: {e}")
+
+    def forget(self, chat_id: int, project_id: str):
+        """Убирает статусное сообщение проекта без отправки накопленного текста"""
+        self._statuses.pop((chat_id, project_id), None)
+
+    async def send_final(self, chat_id: int, project_id: str, message: str):
+        """Финальное сообщение или ошибка: отправляется сразу, отдельным сообщением"""
+        await self.flush()
+        self._statuses.pop((chat_id, project_id), None)
+        await _get_bot().send_message(chat_id, message, parse_mode="Markdown")
+
+progress_notifier = ProgressNotifier()
+
+async def send_message(chat_id: int, text: str):
+    """Разовое сообщение вне статусного: не оставляет записей в progress_notifier"""
+    try:
+        await _get_bot().send_message(chat_id, text, parse_mode="Markdown")
+    except Exception as e:
+        logger.error(f"Ошибка отправки уведомления: {e}")
+
 async def notify_progress(chat_id: int, project_id: str, message: str):
     """Отправляет уведомление о прогрессе обработки"""
-    # Временно просто логируем
     logger.info(f"[NOTIFICATION] {project_id}: {message}")
-    print(f"[NOTIFICATION] {project_id}: {message}")
\ No newline at end of file
+    try:
+        await progress_notifier.update(chat_id, project_id, message)
+    except Exception as e:
+        logger.error(f"Ошибка отправки уведомления: {e}")
+
+# ===== ФОНОВАЯ ОТПРАВКА =====
+# Уведомления, которых задача не должна дожидаться, уходят из отдельного
+# потока. У потока свой постоянный event loop и свой бот с пулом
+# соединений: сессия основного бота привязана к loop воркера
+_NOTIFY_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notify")
+_notify_thread = threading.local()
+
+def _notify_loop():
+    loop = getattr(_notify_thread, "loop", None)
+    if loop is None:
+        loop = _notify_thread.loop = asyncio.new_event_loop()
+    return loop
+
+def fire_and_forget(coro_factory):
+    """Выполняет coro_factory() в потоке уведомлений, не дожидаясь результата"""
+    def run():
+        try:
+            _notify_loop().run_until_complete(coro_factory())
+        except Exception as e:
+            logger.error(f"Ошибка фоновой отправки уведомления: {e}")
+
+    _NOTIFY_POOL.submit(run)
+
+async def send_detached(chat_id: int, text: str):
+    """Отправка из потока уведомлений через бота этого потока"""
+    notify_bot = getattr(_notify_thread, "bot", None)
+    if notify_bot is None:
+        notify_bot = _notify_thread.bot = _create_bot()
+    await notify_bot.send_message(chat_id, text, parse_mode="Markdown")
+
+def _close_notify_thread():
+    loop = getattr(_notify_thread, "loop", None)
+    if loop is None:
+        return
+
+    notify_bot = getattr(_notify_thread, "bot", None)
+    if notify_bot is not None:
+        loop.run_until_complete(notify_bot.session.close())
+        _notify_thread.bot = None
+    loop.close()
+    _notify_thread.loop = None
+
+def drain_notifications():
+    """Дожидается отправки фоновых уведомлений и закрывает бота потока (при остановке процесса)"""
+    _NOTIFY_POOL.submit(_close_notify_thread)
+    _NOTIFY_POOL.shutdown(wait=True)
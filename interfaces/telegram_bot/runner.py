@@ -0,0 +1,86 @@
+# interfaces/telegram_bot/runner.py
+# Получение обновлений Telegram (polling и webhook), общее для bot.py и bot_improved.py
+
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений обрабатывается одновременно
+UPDATES_CONCURRENCY = 32
+
+async def poll_updates(dp: Dispatcher, bot: Bot, polling_bot: Bot):
+    """
+    Получает обновления через polling_bot, а обрабатывает их основным ботом.
+    У polling_bot свой пул соединений и нет лимитера: пауза после 429 на
+    исходящих сообщениях не останавливает получение обновлений
+    """
+    offset = None
+    backoff = 1.0
+    # Telegram не присылает типы обновлений, на которые нет хендлеров
+    allowed_updates = dp.resolve_used_update_types()
+    semaphore = asyncio.Semaphore(UPDATES_CONCURRENCY)
+    tasks = set()
+    
+    def on_done(task: asyncio.Task):
+        tasks.discard(task)
+        semaphore.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Ошибка обработки обновления: %s", task.exception())
+    
+    while True:
+        try:
+            # Длинный long-poll: на тихом боте запрос висит до 30 секунд
+            updates = await polling_bot.get_updates(
+                offset=offset, limit=100, timeout=30, allowed_updates=allowed_updates
+            )
+        except Exception as e:
+            logger.error("Ошибка получения обновлений: %s", e)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+        
+        backoff = 1.0
+        for update in updates:
+            offset = update.update_id + 1
+            # Не больше UPDATES_CONCURRENCY обработчиков; медленный обработчик
+            # не задерживает остальные обновления пачки
+            await semaphore.acquire()
+            task = asyncio.create_task(dp.feed_update(bot, update))
+            tasks.add(task)
+            task.add_done_callback(on_done)
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Принимает обновления через webhook на aiohttp-сервере"""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=settings.WEBHOOK_SECRET
+    ).register(app, path=settings.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    await bot.set_webhook(
+        settings.WEBHOOK_URL,
+        secret_token=settings.WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=True
+    )
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, settings.WEBHOOK_HOST, settings.WEBHOOK_PORT).start()
+    logger.info(
+        "Webhook слушает %s:%s%s",
+        settings.WEBHOOK_HOST, settings.WEBHOOK_PORT, settings.WEBHOOK_PATH
+    )
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,126 @@
+# interfaces/telegram_bot/throttling.py
+# Ограничение частоты исходящих запросов к Telegram Bot API
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений/с на бота, 1 сообщение/с в личный чат,
+# 20 сообщений/мин в группу
+GLOBAL_RATE = 30
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 60 / 20
+
+# Сколько раз повторяем запрос после ответа 429 (Retry-After)
+RETRY_AFTER_ATTEMPTS = 3
+
+class TelegramRateLimiter:
+    """Token bucket на весь бот плюс минимальный интервал между сообщениями в один чат"""
+
+    def __init__(self, global_rate: int = GLOBAL_RATE):
+        self._rate = global_rate
+        self._tokens = float(global_rate)
+        self._updated = time.monotonic()
+        self._global_lock = asyncio.Lock()
+        self._chat_locks: Dict[Union[int, str], asyncio.Lock] = {}
+        self._chat_last_sent: Dict[Union[int, str], float] = {}
+        self._next_prune = 0.0
+        # До этого момента (time.monotonic) все отправки приостановлены
+        self._paused_until = 0.0
+
+    @staticmethod
+    def _chat_interval(chat_id: Union[int, str]) -> float:
+        # Отрицательные ID и @username — группы и каналы
+        if isinstance(chat_id, int) and chat_id > 0:
+            return PRIVATE_CHAT_INTERVAL
+        return GROUP_CHAT_INTERVAL
+
+    def pause(self, seconds: float):
+        """Останавливает все отправки на время, указанное Telegram в retry_after"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def wait_resumed(self):
+        """Ждет окончания паузы после 429"""
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _acquire_global(self):
+        async with self._global_lock:
+            # Пока держим блокировку, остальные отправители тоже ждут
+            await self.wait_resumed()
+            
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._rate, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    def _prune(self, now: float):
+        """Забывает чаты, интервал которых уже истек: иначе словари растут с каждым новым чатом"""
+        self._next_prune = now + GROUP_CHAT_INTERVAL
+        for chat_id, lock in list(self._chat_locks.items()):
+            if lock.locked():
+                continue
+            last_sent = self._chat_last_sent.get(chat_id)
+            if last_sent is None or now - last_sent >= GROUP_CHAT_INTERVAL:
+                del self._chat_locks[chat_id]
+                self._chat_last_sent.pop(chat_id, None)
+
+    async def acquire(self, chat_id: Union[int, str]):
+        """Ждет, пока отправка в чат не нарушит лимиты Telegram"""
+        now = time.monotonic()
+        if now >= self._next_prune:
+            self._prune(now)
+
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = self._chat_locks[chat_id] = asyncio.Lock()
+
+        async with lock:
+            last_sent = self._chat_last_sent.get(chat_id)
+            if last_sent is not None:
+                delay = self._chat_interval(chat_id) - (time.monotonic() - last_sent)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            await self._acquire_global()
+            self._chat_last_sent[chat_id] = time.monotonic()
+
+class ThrottledBot(Bot):
+    """Bot, который пропускает запросы с chat_id через TelegramRateLimiter"""
+
+    def __init__(self, *args, limiter: Optional[TelegramRateLimiter] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or TelegramRateLimiter()
+
+    async def __call__(self, method, request_timeout: Optional[int] = None):
+        # getUpdates, answerCallbackQuery и т.п. не расходуют лимит сообщений
+        chat_id = getattr(method, "chat_id", None)
+
+        for attempt in range(1, RETRY_AFTER_ATTEMPTS + 1):
+            if chat_id is not None:
+                await self.limiter.acquire(chat_id)
+            else:
+                await self.limiter.wait_resumed()
+
+            try:
+                return await super().__call__(method, request_timeout=request_timeout)
+            except TelegramRetryAfter as e:
+                if attempt == RETRY_AFTER_ATTEMPTS:
+                    raise
+                logger.warning("Telegram просит подождать %s с, приостанавливаю отправку", e.retry_after)
+                self.limiter.pause(e.retry_after)
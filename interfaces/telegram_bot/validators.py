@@ -0,0 +1,21 @@
+# interfaces/telegram_bot/validators.py
+# Проверка пользовательского ввода, общая для обоих ботов
+
+from urllib.parse import urlsplit
+
+_YT_HOSTS = frozenset({
+    "youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com", "youtu.be"
+})
+
+def is_youtube_url(url: str) -> bool:
+    """Ссылка на YouTube с любым путем (watch, shorts, live, youtu.be); схема необязательна"""
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+    
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    # Домен проверяем целиком: подстрока youtube.com в параметрах не в счет
+    return parts.scheme in ("http", "https") and parts.hostname in _YT_HOSTS
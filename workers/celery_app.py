@@ -1,7 +1,14 @@
 # workers/celery_app.py
+import asyncio
+import logging
+import sys
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
+from kombu import Queue
 from config.settings import settings
 
+logger = logging.getLogger(__name__)
+
 celery_app = Celery(
     "youtube_automation",
     broker=settings.REDIS_URL,
@@ -12,9 +19,106 @@ celery_app = Celery(
 )
 
 celery_app.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
+    # msgpack компактнее и быстрее stdlib json на больших результатах
+    # pipeline; json оставлен в accept_content для уже поставленных задач
+    task_serializer="msgpack",
+    accept_content=["msgpack", "json"],
+    result_serializer="msgpack",
+    result_accept_content=["msgpack", "json"],
     timezone="UTC",
     enable_utc=True,
-)
\ No newline at end of file
+    # Пул соединений с Redis: без лимита каждая задача открывает свои
+    # соединения к брокеру и бэкенду и упирается в maxclients
+    broker_pool_limit=10,
+    broker_connection_retry_on_startup=True,
+    broker_transport_options={
+        # С task_acks_late задача, не подтвержденная за это время, уходит
+        # другому воркеру: таймаут должен быть больше самой долгой обработки
+        "visibility_timeout": 3 * 3600,
+        "socket_keepalive": True,
+        "health_check_interval": 30,
+    },
+    result_backend_transport_options={
+        "socket_keepalive": True,
+        "health_check_interval": 30,
+    },
+    redis_max_connections=20,
+    # Задачи обработки видео идут 60-90 минут: не резервируем их впрок
+    worker_prefetch_multiplier=1,
+    # Подтверждаем задачу только после выполнения: при падении воркера
+    # обработка вернется в очередь, а не потеряется
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # Whisper и ffmpeg раздувают память процесса, периодически его перезапускаем
+    worker_max_tasks_per_child=50,
+    # Длинные задачи обработки видео и короткие служебные задачи
+    # разнесены по разным очередям, чтобы не блокировать друг друга.
+    # Запуск воркеров:
+    #   celery -A workers.celery_app worker -Q video_long --prefetch-multiplier=1
+    #   celery -A workers.celery_app worker -Q control
+    #   celery -A workers.celery_app worker -Q transient --prefetch-multiplier=16
+    # Очистка файлов и проверки статуса короткие и идемпотентные: у них
+    # своя очередь с большим prefetch, чтобы не ждать за служебными задачами
+    task_queues=(
+        Queue("video_long", routing_key="video_long"),
+        Queue("control", routing_key="control"),
+        Queue("transient", routing_key="transient"),
+    ),
+    task_default_queue="control",
+    task_routes={
+        "workers.tasks.simple_tasks.process_video_simple": {"queue": "video_long"},
+        "workers.tasks.text_tasks.process_text_pipeline": {"queue": "video_long"},
+        "workers.tasks.updated_text_tasks.process_text_pipeline": {"queue": "video_long"},
+        "workers.tasks.updated_text_tasks.cleanup_old_files": {"queue": "transient"},
+        "workers.tasks.updated_text_tasks.check_project_status": {"queue": "transient"},
+    },
+)
+
+# ===== EVENT LOOP ВОРКЕРА =====
+# Один event loop на процесс воркера: HTTP-сессии Telegram и Яндекса,
+# созданные внутри него, переживают задачу и переиспользуют соединения
+_WORKER_LOOP = None
+
+def get_worker_loop():
+    """Возвращает event loop текущего процесса воркера, создавая его при первом вызове"""
+    global _WORKER_LOOP
+    if _WORKER_LOOP is None or _WORKER_LOOP.is_closed():
+        _WORKER_LOOP = asyncio.new_event_loop()
+        asyncio.set_event_loop(_WORKER_LOOP)
+    return _WORKER_LOOP
+
+@worker_process_init.connect
+def _init_worker_loop(**kwargs):
+    get_worker_loop()
+
+@worker_process_init.connect
+def _init_worker_bot(**kwargs):
+    from interfaces.telegram_bot.notifications import init_bot
+    init_bot()
+
+@worker_process_shutdown.connect
+def _flush_log_buffer(**kwargs):
+    from database.crud import log_buffer
+    log_buffer.flush()
+
+@worker_process_shutdown.connect
+def _drain_notifications(**kwargs):
+    notifications = sys.modules.get("interfaces.telegram_bot.notifications")
+    if notifications is not None:
+        notifications.drain_notifications()
+
+@worker_process_shutdown.connect
+def _close_worker_loop(**kwargs):
+    global _WORKER_LOOP
+    if _WORKER_LOOP is None or _WORKER_LOOP.is_closed():
+        return
+    
+    notifications = sys.modules.get("interfaces.telegram_bot.notifications")
+    if notifications is not None:
+        try:
+            _WORKER_LOOP.run_until_complete(notifications.close_bot())
+        except Exception as e:
+            logger.error(f"Ошибка закрытия сессии Telegram: {e}")
+    
+    _WORKER_LOOP.close()
+    _WORKER_LOOP = None
@@ -0,0 +1,74 @@
+# workers/tasks/common.py
+# Общие части задач pipeline (text_tasks и updated_text_tasks)
+
+import functools
+import logging
+from datetime import datetime
+
+from celery.utils.time import get_exponential_backoff_interval
+from database.crud import add_log
+from interfaces.telegram_bot.notifications import progress_notifier, fire_and_forget, send_detached
+
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=1)
+def transient_errors() -> tuple:
+    """
+    Временные сбои сети и перегрузка сервисов: такие задачи повторяются
+    с нарастающей паузой (transient_retry_countdown)
+    """
+    # Импортируем здесь: бот импортирует модули задач ради .delay(),
+    # и SDK сервисов ему не нужны
+    import aiohttp
+    import anthropic
+    import yadisk
+    
+    return (
+        ConnectionError,
+        TimeoutError,  # asyncio.TimeoutError - тот же класс
+        aiohttp.ClientConnectionError,
+        anthropic.APIConnectionError,
+        anthropic.RateLimitError,
+        anthropic.InternalServerError,
+        yadisk.exceptions.RequestError,
+        yadisk.exceptions.RetriableYaDiskError,
+        yadisk.exceptions.TooManyRequestsError,
+    )
+
+def transient_retry_countdown(retries: int) -> int:
+    """Пауза перед повтором после временного сбоя: 60с, 120с, 240с... не больше 10 минут, с jitter"""
+    return get_exponential_backoff_interval(factor=60, retries=retries, maximum=600, full_jitter=True)
+
+class PipelineConfigError(Exception):
+    """Проект или план не найден, ключи не настроены: повтор задачи не поможет"""
+
+@functools.lru_cache(maxsize=1)
+def get_pipeline(config_items: tuple):
+    """
+    Pipeline на процесс воркера: модель Whisper и клиенты сервисов
+    загружаются один раз и переиспользуются следующими задачами
+    """
+    # Импортируем здесь: воркеры служебных очередей не тянут whisper и torch
+    from core.services.updated_text_pipeline import UpdatedTextPipeline
+    return UpdatedTextPipeline(dict(config_items))
+
+def mark_failed(writer, project, project_id: str, error: Exception, note: str):
+    """Помечает проект как failed и в фоне уведомляет пользователя"""
+    logger.error(f"Ошибка в pipeline проекта {project_id}: {str(error)}")
+    
+    writer.patch({
+        "status": "failed",
+        "error_message": str(error),
+        "completed_at": datetime.now()
+    })
+    
+    add_log(project_id, "error", "pipeline", f"❌ Критическая ошибка: {str(error)}")
+    
+    # Уведомление уходит в фоне: задача не ждет ответа Telegram
+    if project and project.telegram_chat_id:
+        chat_id = project.telegram_chat_id
+        progress_notifier.forget(chat_id, project_id)
+        fire_and_forget(lambda: send_detached(
+            chat_id,
+            f"❌ Произошла ошибка при обработке проекта `...{project_id[-8:]}`\n{note}"
+        ))
@@ -2,7 +2,11 @@
 # Celery задачи с двойной обработкой Claude
 
 from celery import shared_task
-from database.crud import update_project, add_log, get_project, get_plan
+from celery.exceptions import Ignore
+from database.crud import ProjectWriter, add_log, get_project, get_plan, log_buffer
+from workers.celery_app import get_worker_loop
+from interfaces.telegram_bot.notifications import progress_notifier
+from workers.tasks.common import PipelineConfigError, get_pipeline, mark_failed, transient_errors, transient_retry_countdown
 from config.settings import settings
 import asyncio
 import logging
@@ -10,25 +14,32 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-@shared_task(bind=True, max_retries=3)
+async def _notify_telegram(chat_id: int, project_id: str, message: str):
+    """Обновляет статусное сообщение проекта в Telegram (с дебаунсом)"""
+    try:
+        await progress_notifier.update(chat_id, project_id, message)
+    except Exception as e:
+        logger.error(f"Ошибка отправки уведомления: {e}")
+
+@shared_task(bind=True, max_retries=3, ignore_result=True)
 def process_text_pipeline(self, project_id: str):
     """Запускает pipeline обработки текста с двойной обработкой Claude"""
     
+    project = None
+    # Быстрое падение или повтор сливают "processing" и итоговый статус в один UPDATE
+    writer = ProjectWriter(project_id)
     try:
-        # Импортируем здесь чтобы избежать циклических импортов
-        from core.pipeline.updated_text_pipeline import UpdatedTextPipeline
-        
         # Получаем данные проекта
         project = get_project(project_id)
         if not project:
-            raise ValueError(f"Проект {project_id} не найден")
+            raise PipelineConfigError(f"Проект {project_id} не найден")
             
         plan = get_plan(project.plan_id)
         if not plan:
-            raise ValueError(f"План {project.plan_id} не найден")
+            raise PipelineConfigError(f"План {project.plan_id} не найден")
         
         # Обновляем статус
-        update_project(project_id, {
+        writer.patch({
             "status": "processing",
             "phase": 1,
             "started_at": datetime.now()
@@ -43,24 +54,15 @@ def process_text_pipeline(self, project_id: str):
             "yandex_disk_token": settings.YANDEX_DISK_TOKEN
         }
         
-        pipeline = UpdatedTextPipeline(config)
+        pipeline = get_pipeline(tuple(sorted(config.items())))
         
         # Коллбеки для обновления прогресса
-        async def update_progress(message: str):
-            add_log(project_id, "info", "pipeline", message)
+        # Запись в лог синхронная; корутина создается только для Telegram
+        def update_progress(message: str):
+            log_buffer.push(project_id, "info", "pipeline", message)
             
-            # Отправляем уведомление в Telegram
             if project.telegram_chat_id:
-                try:
-                    # Динамический импорт для избежания циклических зависимостей
-                    from interfaces.telegram_bot.bot import bot
-                    await bot.send_message(
-                        project.telegram_chat_id,
-                        f"📊 Проект `{project_id[:8]}...`\n{message}",
-                        parse_mode="Markdown"
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления: {e}")
+                return _notify_telegram(project.telegram_chat_id, project_id, message)
         
         callbacks = {
             "download_start": update_progress,
@@ -80,26 +82,13 @@ def process_text_pipeline(self, project_id: str):
         }
         
         # Запускаем pipeline
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        # Преобразуем план в словарь
-        plan_dict = {
-            "name": plan.name,
-            "description": plan.description,
-            "text_steps": plan.text_steps,
-            "video_steps": plan.video_steps,
-            "default_prompt": plan.default_prompt,
-            "default_voice": plan.default_voice,
-            "modules_enabled": plan.modules_enabled,
-            "metadata": plan.metadata if hasattr(plan, 'metadata') else {}
-        }
+        loop = get_worker_loop()
         
         results = loop.run_until_complete(
             pipeline.process(
                 project_id=project_id,
                 youtube_url=project.youtube_url,
-                plan=plan_dict,
+                plan=plan.to_dict(),
                 callbacks=callbacks
             )
         )
@@ -119,7 +108,8 @@ def process_text_pipeline(self, project_id: str):
             "yandex_folder_url": results["yandex_folder_url"]
         }
         
-        update_project(project_id, update_data)
+        writer.patch(update_data)
+        writer.flush()
         
         add_log(project_id, "info", "pipeline", 
                 f"✅ Обработка завершена успешно за {results['processing_time']/60:.1f} минут")
@@ -127,50 +117,40 @@ def process_text_pipeline(self, project_id: str):
         # Отправляем финальное уведомление
         if project.telegram_chat_id:
             try:
-                from interfaces.telegram_bot.bot import bot
                 loop.run_until_complete(
-                    bot.send_message(
+                    progress_notifier.send_final(
                         project.telegram_chat_id,
+                        project_id,
                         f"🎉 Ваш рассказ готов!\n"
                         f"📁 Скачать: {results['yandex_folder_url']}\n"
                         f"⏱ Длительность: ~{results['steps']['speech_generation']['total_duration']/60:.1f} минут\n"
-                        f"📝 Слов: {results['steps']['text_processing']['word_count']}",
-                        parse_mode="Markdown"
+                        f"📝 Слов: {results['steps']['text_processing']['word_count']}"
                     )
                 )
             except Exception as e:
                 logger.error(f"Ошибка отправки финального уведомления: {e}")
         
-        return results
+        # Тексты и аудио уже сохранены в проекте, в бэкенд результатов их не пишем
+        return {"status": "completed", "project_id": project_id}
         
+    except PipelineConfigError as e:
+        # Проект или план не найден, ключи не настроены: повтор не поможет
+        mark_failed(writer, project, project_id, e, "Проверьте проект и запустите его заново.")
+        raise Ignore()
+    
     except Exception as e:
-        logger.error(f"Ошибка в pipeline проекта {project_id}: {str(e)}")
-        
-        update_project(project_id, {
-            "status": "failed",
-            "error_message": str(e),
-            "completed_at": datetime.now()
-        })
-        
-        add_log(project_id, "error", "pipeline", f"❌ Критическая ошибка: {str(e)}")
-        
-        # Уведомляем пользователя об ошибке
-        try:
-            project = get_project(project_id)
-            if project and project.telegram_chat_id:
-                from interfaces.telegram_bot.bot import bot
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(
-                    bot.send_message(
-                        project.telegram_chat_id,
-                        f"❌ Произошла ошибка при обработке проекта `{project_id[:8]}...`\n"
-                        f"Попробуем еще раз через 5 минут.",
-                        parse_mode="Markdown"
-                    )
-                )
-        except:
-            pass
-        
-        # Повторная попытка
-        raise self.retry(exc=e, countdown=300)  # Повтор через 5 минут
\ No newline at end of file
+        # Статус failed и уведомление только когда попытки кончились:
+        # промежуточные сбои в БД и в Telegram не попадают
+        if self.request.retries >= self.max_retries:
+            mark_failed(writer, project, project_id, e, "Попробуйте запустить проект позже.")
+            raise
+        
+        logger.warning(f"Сбой pipeline проекта {project_id}, попытка {self.request.retries + 1}: {e}")
+        if isinstance(e, transient_errors()):
+            raise self.retry(exc=e, countdown=transient_retry_countdown(self.request.retries))
+        raise self.retry(exc=e, countdown=300)  # Повтор через 5 минут
+    
+    finally:
+        # Статус проекта и логи прогресса пишем до выхода из задачи
+        writer.flush()
+        log_buffer.flush()
\ No newline at end of file
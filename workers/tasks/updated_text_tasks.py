@@ -2,32 +2,37 @@
 # Обновленные Celery задачи с двойной обработкой Claude
 
 from celery import shared_task
-from core.pipeline.updated_text_pipeline import UpdatedTextPipeline
-from database.crud import update_project, add_log, get_project, get_plan
+from celery.exceptions import Ignore
+from database.crud import ProjectWriter, add_log, get_project, get_plan, log_buffer
+from workers.celery_app import get_worker_loop
 from config.secure_settings import settings
-from interfaces.telegram_bot.improved_bot import notify_progress
+from interfaces.telegram_bot.notifications import notify_progress, progress_notifier, send_message
+from workers.tasks.common import PipelineConfigError, get_pipeline, mark_failed, transient_errors, transient_retry_countdown
 import asyncio
 import logging
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-@shared_task(bind=True, max_retries=3)
+@shared_task(bind=True, max_retries=3, ignore_result=True)
 def process_text_pipeline(self, project_id: str):
     """Запускает pipeline обработки текста с двойной обработкой Claude"""
     
+    project = None
+    # Быстрое падение или повтор сливают "processing" и итоговый статус в один UPDATE
+    writer = ProjectWriter(project_id)
     try:
         # Получаем данные проекта
         project = get_project(project_id)
         if not project:
-            raise ValueError(f"Проект {project_id} не найден")
+            raise PipelineConfigError(f"Проект {project_id} не найден")
             
         plan = get_plan(project.plan_id)
         if not plan:
-            raise ValueError(f"План {project.plan_id} не найден")
+            raise PipelineConfigError(f"План {project.plan_id} не найден")
         
         # Обновляем статус
-        update_project(project_id, {
+        writer.patch({
             "status": "processing",
             "phase": 1,
             "started_at": datetime.now()
@@ -35,7 +40,7 @@ def process_text_pipeline(self, project_id: str):
         
         # Проверяем конфигурацию
         if not settings.is_fully_configured():
-            raise ValueError("Не все API ключи настроены. Проверьте .env файл")
+            raise PipelineConfigError("Не все API ключи настроены. Проверьте .env файл")
         
         # Создаем pipeline
         config = {
@@ -46,15 +51,15 @@ def process_text_pipeline(self, project_id: str):
             "yandex_disk_token": settings.YANDEX_DISK_TOKEN
         }
         
-        pipeline = UpdatedTextPipeline(config)
+        pipeline = get_pipeline(tuple(sorted(config.items())))
         
         # Коллбеки для обновления прогресса
-        async def update_progress(message: str):
-            add_log(project_id, "info", "pipeline", message)
+        # Запись в лог синхронная; корутина создается только для Telegram
+        def update_progress(message: str):
+            log_buffer.push(project_id, "info", "pipeline", message)
             
-            # Отправляем уведомление в Telegram
             if project.telegram_chat_id:
-                await notify_progress(project.telegram_chat_id, project_id, message)
+                return notify_progress(project.telegram_chat_id, project_id, message)
         
         callbacks = {
             "download_start": update_progress,
@@ -74,14 +79,13 @@ def process_text_pipeline(self, project_id: str):
         }
         
         # Запускаем pipeline
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        loop = get_worker_loop()
         
         results = loop.run_until_complete(
             pipeline.process(
                 project_id=project_id,
                 youtube_url=project.youtube_url,
-                plan=plan.__dict__,
+                plan=plan.to_dict(),
                 callbacks=callbacks
             )
         )
@@ -101,88 +105,88 @@ def process_text_pipeline(self, project_id: str):
             "yandex_folder_url": results["yandex_folder_url"]
         }
         
-        update_project(project_id, update_data)
+        writer.patch(update_data)
+        writer.flush()
         
         add_log(project_id, "info", "pipeline", 
                 f"✅ Обработка завершена успешно за {results['processing_time']/60:.1f} минут")
         
         # Отправляем финальное уведомление
         if project.telegram_chat_id:
-            loop.run_until_complete(
-                notify_progress(
-                    project.telegram_chat_id, 
-                    project_id,
-                    f"🎉 Ваш рассказ готов!\n"
-                    f"📁 Скачать: {results['yandex_folder_url']}\n"
-                    f"⏱ Длительность: ~{results['steps']['speech_generation']['total_duration']/60:.1f} минут\n"
-                    f"📝 Слов: {results['steps']['text_processing']['word_count']}"
-                )
-            )
-        
-        return results
-        
-    except Exception as e:
-        logger.error(f"Ошибка в pipeline проекта {project_id}: {str(e)}")
-        
-        update_project(project_id, {
-            "status": "failed",
-            "error_message": str(e),
-            "completed_at": datetime.now()
-        })
-        
-        add_log(project_id, "error", "pipeline", f"❌ Критическая ошибка: {str(e)}")
-        
-        # Уведомляем пользователя об ошибке
-        try:
-            project = get_project(project_id)
-            if project and project.telegram_chat_id:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
+            try:
                 loop.run_until_complete(
-                    notify_progress(
+                    progress_notifier.send_final(
                         project.telegram_chat_id,
                         project_id,
-                        f"❌ Произошла ошибка при обработке.\n"
-                        f"Попробуем еще раз через 5 минут."
+                        f"🎉 Ваш рассказ готов!\n"
+                        f"📁 Скачать: {results['yandex_folder_url']}\n"
+                        f"⏱ Длительность: ~{results['steps']['speech_generation']['total_duration']/60:.1f} минут\n"
+                        f"📝 Слов: {results['steps']['text_processing']['word_count']}"
                     )
                 )
-        except:
-            pass
+            except Exception as e:
+                logger.error(f"Ошибка отправки финального уведомления: {e}")
+        
+        # Тексты и аудио уже сохранены в проекте, в бэкенд результатов их не пишем
+        return {"status": "completed", "project_id": project_id}
         
-        # Повторная попытка
+    except PipelineConfigError as e:
+        # Проект или план не найден, ключи не настроены: повтор не поможет
+        mark_failed(writer, project, project_id, e, "Проверьте проект и запустите его заново.")
+        raise Ignore()
+    
+    except Exception as e:
+        # Статус failed и уведомление только когда попытки кончились:
+        # промежуточные сбои в БД и в Telegram не попадают
+        if self.request.retries >= self.max_retries:
+            mark_failed(writer, project, project_id, e, "Попробуйте запустить проект позже.")
+            raise
+        
+        logger.warning(f"Сбой pipeline проекта {project_id}, попытка {self.request.retries + 1}: {e}")
+        if isinstance(e, transient_errors()):
+            raise self.retry(exc=e, countdown=transient_retry_countdown(self.request.retries))
         raise self.retry(exc=e, countdown=300)  # Повтор через 5 минут
+    
+    finally:
+        # Статус проекта и логи прогресса пишем до выхода из задачи
+        writer.flush()
+        log_buffer.flush()
 
 @shared_task
 def cleanup_old_files(days_to_keep: int = 7):
     """Очищает старые файлы проектов"""
     import os
     import shutil
+    from concurrent.futures import ThreadPoolExecutor
     from datetime import datetime, timedelta
     
-    cutoff_date = datetime.now() - timedelta(days=days_to_keep)
+    cutoff_time = (datetime.now() - timedelta(days=days_to_keep)).timestamp()
     
-    # Очищаем папку downloads
-    downloads_dir = settings.DOWNLOAD_DIR
-    if os.path.exists(downloads_dir):
-        for folder in os.listdir(downloads_dir):
-            folder_path = os.path.join(downloads_dir, folder)
-            if os.path.isdir(folder_path):
-                # Проверяем дату создания
-                folder_time = datetime.fromtimestamp(os.path.getctime(folder_path))
-                if folder_time < cutoff_date:
-                    logger.info(f"Удаляем старую папку: {folder_path}")
-                    shutil.rmtree(folder_path)
+    # Один проход scandir по downloads и outputs: тип и ctime берутся
+    # из записи каталога без отдельных isdir/getctime на каждую папку
+    victims = []
+    for base_dir in (settings.DOWNLOAD_DIR, settings.OUTPUT_DIR):
+        if not os.path.exists(base_dir):
+            continue
+        with os.scandir(base_dir) as it:
+            victims.extend(
+                entry.path for entry in it
+                if entry.is_dir(follow_symlinks=False) and entry.stat().st_ctime < cutoff_time
+            )
+    
+    for folder_path in victims:
+        logger.info(f"Удаляем старую папку: {folder_path}")
+    
+    def remove(folder_path):
+        # Ошибка на одной папке не должна прерывать удаление остальных
+        try:
+            shutil.rmtree(folder_path)
+        except OSError as e:
+            logger.error(f"Не удалось удалить папку {folder_path}: {e}")
     
-    # Очищаем папку outputs
-    outputs_dir = settings.OUTPUT_DIR
-    if os.path.exists(outputs_dir):
-        for folder in os.listdir(outputs_dir):
-            folder_path = os.path.join(outputs_dir, folder)
-            if os.path.isdir(folder_path):
-                folder_time = datetime.fromtimestamp(os.path.getctime(folder_path))
-                if folder_time < cutoff_date:
-                    logger.info(f"Удаляем старую папку: {folder_path}")
-                    shutil.rmtree(folder_path)
+    # Удаление упирается в диск, поэтому папки удаляем параллельно
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(remove, victims))
     
     logger.info("Очистка старых файлов завершена")
 
@@ -205,14 +209,12 @@ def check_project_status(project_id: str):
                 
                 # Отправляем предупреждение
                 if project.telegram_chat_id:
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
+                    loop = get_worker_loop()
                     loop.run_until_complete(
-                        notify_progress(
+                        send_message(
                             project.telegram_chat_id,
-                            project_id,
-                            "⚠️ Обработка занимает больше времени чем обычно.\n"
-                            "Проверяем статус..."
+                            f"⚠️ Проект `...{project_id[-8:]}`: обработка занимает "
+                            f"больше времени чем обычно.\nПроверяем статус..."
                         )
                     )
     